@@ -1,5 +1,6 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
+from jobparse import tasks
 from jobparse.forms import BusinessUnitForm
 from jobparse.models import BusinessUnit
 
@@ -24,13 +25,13 @@ class BusinessUnitAdmin(admin.ModelAdmin):
         """
         Sends a message via Celery to download & parse the feedfile for a
         given Business Unit, then write the results to the Solr index and
-        the RDBMS.
+        the RDBMS. Every job is written again, even if the feed hasn't
+        changed since it was last imported. If the Business Unit is being
+        refreshed already, this happens once that refresh has finished.
 
         """
         for business_unit in queryset:
-            tasks.task_refresh_bunit_jobs.delay(business_unit.id,
-                                                update_all=True)
-            tasks.task_update_solr.delay(business_unit.id, force=True)
+            tasks.reset_business_unit(business_unit.id)
             
         messages.info(request, "All jobs for Business Unit %s will be "
                       "re-processed shortly." % business_unit.id)
@@ -0,0 +1,169 @@
+"""
+Coalescing of the notifications that a feed is ready, so that a burst of
+them for a Business Unit (or the same one delivered again) causes one
+refresh rather than one each.
+
+A notification that arrives while a refresh of the Business Unit is
+queued is dropped, since the queued refresh will download the latest
+feed anyway. One that arrives while a refresh is running marks the
+Business Unit dirty, and however many do, a single follow-up refresh is
+queued once the running one finishes.
+
+The state is kept in a store: a `CacheStore` (the default) shares it
+between every process using the same Django cache, while a `MemoryStore`
+keeps it in the current process, for tests. The store used is named by
+the NOTIFICATION_STORE setting.
+
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.utils.importlib import import_module
+
+
+class Coalescer(object):
+    """
+    Inputs:
+    :store: A store, e.g. a `CacheStore`.
+    :timeout: Seconds after which the state of a Business Unit expires,
+    in case the refresh for it died without calling `finish`.
+    :prefix: The prefix of the keys kept in the store, so that coalescers
+    for different kinds of refresh can share one.
+
+    A refresh is queued by the caller whenever `notify` or `finish`
+    returns True, and calls `start` and then `finish` as it runs:
+
+        >> if notifications.notify(buid):
+        >>     task.delay(buid)
+        ...
+        >> notifications.start(buid)
+        >> try:
+        >>     refresh_business_unit(buid)
+        >> finally:
+        >>     if notifications.finish(buid):
+        >>         task.delay(buid)
+
+    """
+    def __init__(self, store, timeout=2 * 3600, prefix='jobparse.notify'):
+        self.store = store
+        self.timeout = timeout
+        self.prefix = prefix
+
+    def _keys(self, buid):
+        return ("%s.pending.%s" % (self.prefix, buid),
+                "%s.dirty.%s" % (self.prefix, buid))
+
+    def notify(self, buid):
+        """
+        Record a notification for `buid`. Returns True if a refresh
+        should be queued for it, and False if one is already queued or
+        running.
+
+        """
+        pending, dirty = self._keys(buid)
+
+        if self.store.add(pending, True, self.timeout):
+            return True
+
+        self.store.set(dirty, True, self.timeout)
+        return False
+
+    def start(self, buid):
+        """
+        Record that the refresh for `buid` has started. It covers every
+        notification received so far.
+
+        """
+        self.store.delete(self._keys(buid)[1])
+
+    def defer(self, buid):
+        """
+        Record that the refresh for `buid` couldn't run (e.g. because the
+        Business Unit was locked by another refresh), so that `finish`
+        asks for another one rather than dropping the notifications.
+
+        """
+        self.store.set(self._keys(buid)[1], True, self.timeout)
+
+    def finish(self, buid):
+        """
+        Record that the refresh for `buid` has finished. Returns True if
+        notifications arrived while it ran, in which case a follow-up
+        refresh should be queued.
+
+        """
+        pending, dirty = self._keys(buid)
+        self.store.delete(pending)
+
+        if not self.store.get(dirty):
+            return False
+
+        # Any notification since `delete` either queued a refresh itself
+        # or set `dirty` again; either way this queues nothing more.
+        self.store.delete(dirty)
+        return self.notify(buid)
+
+
+class CacheStore(object):
+    """A store kept in the Django cache named `cache_name`."""
+    def __init__(self, cache_name='default'):
+        self.cache = get_cache(cache_name)
+
+    def add(self, key, value, timeout):
+        """Set `key` unless it is already set. Returns True if it was."""
+        return self.cache.add(key, value, timeout)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, timeout):
+        self.cache.set(key, value, timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+
+class MemoryStore(object):
+    """A store kept in a dictionary, for a single process."""
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def add(self, key, value, timeout):
+        with self.lock:
+            if self._get(key) is not None:
+                return False
+
+            self.data[key] = (value, time.time() + timeout)
+            return True
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key):
+        value, expires = self.data.get(key, (None, None))
+
+        if expires is not None and expires < time.time():
+            del self.data[key]
+            return None
+
+        return value
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            self.data[key] = (value, time.time() + timeout)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+
+def get_store():
+    """Return an instance of the store named by NOTIFICATION_STORE."""
+    path = getattr(settings, 'NOTIFICATION_STORE',
+                   'jobparse.coalesce.CacheStore')
+    module, name = path.rsplit('.', 1)
+    return getattr(import_module(module), name)()
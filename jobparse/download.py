@@ -0,0 +1,219 @@
+"""
+Fetching feed files over HTTP.
+
+Feeds are requested gzipped and read in chunks, so neither the download
+nor a feed's decompressed contents are ever held in memory whole. When
+the validators (ETag and Last-Modified) and content hash of the last
+copy fetched are passed in, an unchanged feed is recognised either by a
+304 from the server or, failing that, by its content hash.
+
+A feed can also be parsed while it downloads, without being saved
+first, by handing the parser a `PrefetchReader` over `open_feed`.
+
+"""
+import hashlib
+import os
+import threading
+import urllib2
+import zlib
+import Queue
+from collections import namedtuple
+
+# Bytes read from the response at a time.
+CHUNK_SIZE = 64 * 1024
+
+FeedDownload = namedtuple('FeedDownload', ['path', 'changed', 'etag',
+                                           'last_modified', 'content_hash'])
+
+
+class FeedResponse(object):
+    """
+    A file-like wrapper around an HTTP response that decompresses it if
+    it was sent gzipped, and hashes the decompressed content as it is
+    read. `content_hash` is only complete once `read` has returned '',
+    and `size` is the number of decompressed bytes read so far.
+
+    """
+    def __init__(self, response):
+        self.response = response
+        headers = response.info()
+        self.etag = headers.get('ETag')
+        self.last_modified = headers.get('Last-Modified')
+
+        if headers.get('Content-Encoding') == 'gzip':
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._decompressor = None
+
+        self._sha1 = hashlib.sha1()
+        self.size = 0
+        self._buffer = ''
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self.response.read(CHUNK_SIZE)
+
+            if not chunk:
+                self._eof = True
+
+                if self._decompressor is not None:
+                    self._buffer += self._decompressor.flush()
+            elif self._decompressor is not None:
+                self._buffer += self._decompressor.decompress(chunk)
+            else:
+                self._buffer += chunk
+
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+
+        self._sha1.update(data)
+        self.size += len(data)
+        return data
+
+    @property
+    def content_hash(self):
+        return self._sha1.hexdigest()
+
+    def close(self):
+        self.response.close()
+
+
+class PrefetchReader(object):
+    """
+    A file-like object that reads another one ahead from a background
+    thread, so that the network and whatever consumes the data (the feed
+    parser) work at the same time.
+
+    At most `max_chunks` chunks of CHUNK_SIZE bytes are read ahead; past
+    that the thread waits for the consumer, so memory use stays bounded
+    however large the feed. If `copy_path` is given, everything read is
+    also written to that file. An exception raised while reading the
+    source is raised again from `read`.
+
+    """
+    def __init__(self, source, max_chunks=16, copy_path=None):
+        self.source = source
+        self._queue = Queue.Queue(maxsize=max_chunks)
+        self._chunk = ''
+        self._eof = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._fill, args=(copy_path,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _fill(self, copy_path):
+        copy = open(copy_path, 'wb') if copy_path else None
+
+        try:
+            while not self._closed:
+                chunk = self.source.read(CHUNK_SIZE)
+
+                if copy is not None:
+                    copy.write(chunk)
+
+                self._put(chunk)
+
+                if not chunk:
+                    break
+        except Exception as e:
+            self._put(e)
+        finally:
+            if copy is not None:
+                copy.close()
+
+    def _put(self, item):
+        # Don't wait forever on a consumer that has gone away.
+        while not self._closed:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def read(self, size=-1):
+        if size < 0:
+            return ''.join(iter(lambda: self.read(CHUNK_SIZE), ''))
+
+        if not self._chunk and not self._eof:
+            item = self._queue.get()
+
+            if isinstance(item, Exception):
+                self._eof = True
+                raise item
+
+            self._eof = not item
+            self._chunk = item
+
+        # Hand back what has arrived rather than waiting to fill `size`.
+        data, self._chunk = self._chunk[:size], self._chunk[size:]
+        return data
+
+    def close(self):
+        """Stop reading ahead and close the source."""
+        self._closed = True
+        self.source.close()
+        self._thread.join()
+
+
+def open_feed(url, etag=None, last_modified=None, timeout=300):
+    """
+    Request `url`, asking for it gzipped and, given the validators of a
+    previous response, only if it has changed since.
+
+    Returns:
+    A `FeedResponse`, or None if the server answered 304 Not Modified.
+
+    """
+    request = urllib2.Request(url, headers={'Accept-Encoding': 'gzip'})
+
+    if etag:
+        request.add_header('If-None-Match', etag)
+
+    if last_modified:
+        request.add_header('If-Modified-Since', last_modified)
+
+    try:
+        return FeedResponse(urllib2.urlopen(request, timeout=timeout))
+    except urllib2.HTTPError as e:
+        if e.code == 304:
+            return None
+        raise
+
+
+def fetch(url, path, etag=None, last_modified=None, content_hash=None):
+    """
+    Download `url` to `path`, unless it hasn't changed since the copy
+    that `etag`, `last_modified` and `content_hash` came from.
+
+    The file is written under a temporary name and renamed into place
+    once complete, so `path` never holds a partial download.
+
+    Returns:
+    A `FeedDownload`. If `changed` is False, the other fields are those
+    passed in, and `path` is None if nothing was written.
+
+    """
+    feed = open_feed(url, etag=etag, last_modified=last_modified)
+
+    if feed is None:
+        return FeedDownload(None, False, etag, last_modified, content_hash)
+
+    partial = "%s.%s.part" % (path, os.getpid())
+
+    try:
+        with open(partial, 'wb') as f:
+            for chunk in iter(lambda: feed.read(CHUNK_SIZE), ''):
+                f.write(chunk)
+    except:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        feed.close()
+
+    os.rename(partial, path)
+    return FeedDownload(path, feed.content_hash != content_hash, feed.etag,
+                        feed.last_modified, feed.content_hash)
@@ -0,0 +1,216 @@
+"""
+A store for downloaded feed files, shared by every task on a machine.
+
+Each feed file is kept as <root>/<buid>/<content hash>.xml. A file is
+only ever moved into place whole and is never written to again, so any
+number of tasks can read the same copy, and a retry can pick up the copy
+an earlier attempt downloaded (found by the reuse key it was stored
+with) instead of fetching the feed again.
+
+Nothing deletes a stored feed file directly. Readers hold a lease on a
+file while they use it, and `FeedStore.evict` removes files that are not
+leased once they are older than `ttl`, or oldest first while the store
+holds more than `max_bytes`.
+
+"""
+import glob
+import hashlib
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+class FeedStore(object):
+    """
+    Inputs:
+    :root: The directory the store lives in.
+    :max_bytes: The most disk space the stored feed files may use, apart
+    from files that are leased.
+    :ttl: Seconds after which a stored feed file is evicted.
+    :lease_ttl: Seconds after which a lease is assumed to belong to a
+    task that died without releasing it.
+
+    """
+    def __init__(self, root, max_bytes=2 * 1024 ** 3, ttl=2 * 24 * 3600,
+                 lease_ttl=6 * 3600):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lease_ttl = lease_ttl
+
+    def _dir(self, buid):
+        path = os.path.join(self.root, str(buid))
+
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                # Another task created it first.
+                if not os.path.isdir(path):
+                    raise
+
+        return path
+
+    def partial_path(self, buid):
+        """
+        Return a path, unique to the caller, to download a feed file for
+        `buid` to before passing it to `add`.
+
+        """
+        return os.path.join(self._dir(buid), "%s.%s.part" %
+                            (os.getpid(), uuid.uuid4().hex))
+
+    def add(self, buid, path, content_hash=None, **info):
+        """
+        Move the feed file at `path` into the store and return its new
+        path. Any keyword arguments (e.g. the ETag the feed was served
+        with) are stored alongside it; see `info`.
+
+        """
+        if content_hash is None:
+            content_hash = file_hash(path)
+
+        target = os.path.join(self._dir(buid), content_hash + '.xml')
+        info['content_hash'] = content_hash
+        partial = self.partial_path(buid)
+
+        with open(partial, 'w') as f:
+            json.dump(info, f)
+
+        os.rename(partial, target[:-4] + '.json')
+        # If the same feed file was already stored, this replaces it with
+        # an identical copy; anyone reading the old one keeps reading it.
+        os.rename(path, target)
+        self.evict()
+        return target
+
+    def latest(self, buid, max_age=None, reuse_key=None):
+        """
+        Return the path of the feed file for `buid` stored most recently,
+        or None if there is none (no more than `max_age` seconds old, and
+        stored with `reuse_key` if one is given).
+
+        """
+        files = glob.glob(os.path.join(self.root, str(buid), '*.xml'))
+        files = [(os.path.getmtime(path), path) for path in files
+                 if os.path.exists(path) and
+                 (reuse_key is None or
+                  self.info(path).get('reuse_key') == reuse_key)]
+
+        if not files:
+            return None
+
+        mtime, path = max(files)
+
+        if max_age is not None and time.time() - mtime > max_age:
+            return None
+
+        return path
+
+    def info(self, path):
+        """Return what was stored alongside the feed file at `path`."""
+        try:
+            with open(path[:-4] + '.json') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {'content_hash': os.path.basename(path)[:-4]}
+
+    def contains(self, path):
+        return (isinstance(path, basestring) and
+                os.path.abspath(path).startswith(self.root + os.sep))
+
+    @contextmanager
+    def lease(self, path):
+        """
+        Keep the feed file at `path` from being evicted while in use. Does
+        nothing if `path` isn't in the store.
+
+        """
+        if not self.contains(path):
+            yield path
+            return
+
+        lease = "%s.%s.lease" % (path, uuid.uuid4().hex)
+        open(lease, 'w').close()
+
+        try:
+            yield path
+        finally:
+            os.remove(lease)
+
+    def evict(self):
+        """
+        Remove expired feed files, then the oldest ones while the store is
+        over budget, skipping any that are leased. Stale leases and
+        abandoned partial downloads are removed too.
+
+        """
+        now = time.time()
+        leased = set()
+
+        for lease in glob.glob(os.path.join(self.root, '*', '*.lease')):
+            if now - _mtime(lease, now) > self.lease_ttl:
+                _remove(lease)
+            else:
+                leased.add(lease.rsplit('.', 2)[0])
+
+        for partial in glob.glob(os.path.join(self.root, '*', '*.part')):
+            if now - _mtime(partial, now) > self.ttl:
+                _remove(partial)
+
+        files = []
+
+        for path in glob.glob(os.path.join(self.root, '*', '*.xml')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for mtime, size, path in files)
+
+        for mtime, size, path in sorted(files):
+            if path in leased:
+                continue
+
+            if now - mtime > self.ttl or total > self.max_bytes:
+                _remove(path)
+                _remove(path[:-4] + '.json')
+                total -= size
+
+
+def file_hash(path):
+    """Return the SHA-1 hex digest of the contents of the file at `path`."""
+    sha1 = hashlib.sha1()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), ''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+
+def _mtime(path, default):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return default
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+feed_store = FeedStore(
+    os.path.join(settings.DATA_DIR, 'feeds'),
+    max_bytes=getattr(settings, 'FEED_STORE_MAX_BYTES', 2 * 1024 ** 3),
+    ttl=getattr(settings, 'FEED_STORE_TTL', 2 * 24 * 3600)
+)
@@ -1,5 +1,8 @@
+from collections import OrderedDict
 from itertools import islice
 
+from slugify import slugify
+
 def take(n, seq):
     "Return first n items of the seq as a list"
     return list(islice(seq, n))
@@ -11,42 +14,65 @@ def drop(n, seq):
 def split_by(n, seq):
     return [take(n, seq), drop(n, seq)]
 
-def slices(seq, start=0, end=None, step=2):
+def chunked(n, iterable):
+    "Yield successive lists of at most n items from iterable."
+    it = iter(iterable)
+    chunk = take(n, it)
+
+    while chunk:
+        yield chunk
+        chunk = take(n, it)
+
+
+class LRUCache(object):
     """
-    Takes a sequence 'seq' and yields a 2-tuple that expresses a
-    'step'-sized. Ex:
-
-    >> x = slices(range(20), step=4)
-    >> x.next()
-    (0, 4)
-    >> x.next()
-    (4, 8)
-    >> x.next()
-    (8, 12)
-
-    etc. Put another way:
-    
-    >> x = slices(range(20), step=4)
-    >> [i for i in x]
-    [(0, 4), (4, 8), (8, 12), (12, 16), (16, 20), (20, 21)]
-
-    Note the calculation of the 'rng' variable. If 'len(seq)' is a
-    multiple of 'step', we add an additional item onto the end so we make
-    sure to get each item. (This is why in the example above the last
-    tuple is '(20, 21)'.)
-    
+    Memoize a single-argument function, keeping the results for at most
+    'maxsize' distinct arguments. When the cache is full, the result that
+    was least recently used is dropped.
+
+    The 'hits' and 'misses' counters can be used to size the cache; see
+    'stats'.
+
+    >> cached_len = LRUCache(len, maxsize=2)
+    >> cached_len("abc")
+    3
+    >> cached_len.stats()
+    {'hits': 0, 'misses': 1, 'size': 1, 'maxsize': 2, 'hit_rate': 0.0}
+
     """
-    fun = split_by
-    ls = len(seq)
-    if ls < step and seq:
-        yield (0, ls)
-    else:
-        if ls % step:
-            rng = xrange(ls/step+1)
+    def __init__(self, func, maxsize=1024):
+        self.func = func
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def __call__(self, arg):
+        try:
+            result = self._results.pop(arg)
+        except KeyError:
+            self.misses += 1
+            result = self.func(arg)
+
+            if len(self._results) >= self.maxsize:
+                self._results.popitem(last=False)
         else:
-            rng = xrange(ls/step)
-            
-        for i in rng:
-            segment = fun(step, seq[start:])
-            start += step
-            yield segment[0][0], segment[0][-1]
+            self.hits += 1
+
+        self._results[arg] = result
+        return result
+
+    def clear(self):
+        self._results.clear()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        calls = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._results), 'maxsize': self.maxsize,
+                'hit_rate': float(self.hits) / calls if calls else 0.0}
+
+# City, state, country and title values repeat heavily across jobs, so
+# slugs are shared by every feed parsed and every jobListing saved in a
+# process.
+slug = LRUCache(slugify, maxsize=20000)
@@ -1,25 +1,337 @@
 import os
 import sys
-import urllib
 import datetime
+import itertools
 import logging
-from itertools import izip_longest
+import multiprocessing
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
 
 from lxml import etree
-from pysolr import Solr
     
 from django.conf import settings
-from django.db import transaction
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import signals
+from django.dispatch.dispatcher import _make_id
+from django.utils.importlib import import_module
 
+import download as feeddownload
+from .feedstore import feed_store
+import instrument
 import xmlparse
-from .helpers import slices
+import solrconn
+from .helpers import chunked, slug
 from .models import BusinessUnit, jobListing
 
 BASE_DIR = settings.BASE_DIR
 DATA_DIR = settings.DATA_DIR
 FEED_FILE_PREFIX = "dseo_feed_"
+# Seconds after which the lock on a business unit expires, in case the
+# process holding it died without releasing it.
+BU_LOCK_TIMEOUT = getattr(settings, 'BU_LOCK_TIMEOUT', 2 * 3600)
+# Worker processes used by `refresh_business_units`. None means one per
+# CPU.
+IMPORT_PROCESSES = getattr(settings, 'IMPORT_PROCESSES', None)
+# Number of jobs held in memory at once when a feed file is streamed into
+# the database.
+DB_STREAM_CHUNK_SIZE = 1000
+# Number of jobs removed per DELETE statement (and transaction) by
+# `delete_jobs`. Kept under SQLite's limit of 999 query parameters.
+DB_DELETE_CHUNK_SIZE = 500
+# Number of uids looked up per query by `bulk_save_jobs`. Kept under
+# SQLite's limit of 999 query parameters.
+DB_LOOKUP_CHUNK_SIZE = 500
+# Number of documents fetched per request when listing the jobs in the
+# Solr index for a business unit.
+SOLR_UID_PAGE_SIZE = 1024
+# Number of documents deleted per request.
+SOLR_DELETE_CHUNK_SIZE = 4096
+# The Solr client set by `set_solr_backend`, or made from the SOLR_BACKEND
+# setting. None means the pooled client from `solrconn.connections`.
+_solr_backend = None
 
-def refresh_bunit_jobs(buid, download=True, update_all=True):
+def refresh_business_unit(buid, download=True, update_all=True, force=True,
+                          set_title=False, stream=True, skip_unchanged=True,
+                          conditional=True, direct=False, keep_copy=False,
+                          reuse_key=None, deterministic_salt=None):
+    """
+    Download the feed file for a Business Unit once, parse it once, and
+    write the jobs in it to both the RDBMS and the Solr index.
+
+    Inputs:
+    :buid: An integer; the ID for a particular business unit.
+    :download: Boolean. If False, use the feed file already on disk.
+    :update_all: Boolean. Passed to `DatabaseSink`.
+    :force: Boolean. Passed to `SolrSink`. See `update_solr`.
+    :set_title: Boolean. Passed to `SolrSink`. See `update_solr`.
+    :stream: Boolean. If True, the feed file is parsed incrementally.
+    :skip_unchanged: Boolean. Passed to both sinks. If True, jobs whose
+    content hasn't changed since they were last written are skipped.
+    :conditional: Boolean. If True, and the feed file hasn't changed
+    since the last one this function imported without errors, nothing
+    is parsed or written. See `fetch_feed_file`.
+    :direct: Boolean. If True (and `download` is True), the feed is
+    parsed as it downloads rather than saved to disk first, so the first
+    jobs are written before the download finishes. Implies `stream`. Only
+    a 304 from the server can tell the feed is unchanged this way.
+    :keep_copy: Boolean. With `direct`, also save the feed file to
+    DATA_DIR as it downloads, for debugging.
+    :reuse_key: Passed to `fetch_feed_file` or `store_feed_file`.
+    :deterministic_salt: Boolean, or None to use the
+    DETERMINISTIC_SALTED_DATE setting. If True, the salted_date of each
+    Solr document is derived from the job rather than picked at random
+    (see `xmlparse.DEJobFeed`), so reprocessing an unchanged feed produces
+    identical documents.
+
+    Returns:
+    A dictionary with a 'database' and a 'solr' key, each holding the
+    results of the corresponding sink. A sink that failed has the
+    exception that stopped it under its 'error' key; a failure in one
+    sink does not stop the other. Its 'unchanged' key is True if the
+    feed file was unchanged and so nothing was done, in which case both
+    results are None.
+
+    The time spent in each stage of the run and the amount of work done
+    are emitted through `instrument.ImportStats`.
+
+    """
+    logging.info("XML Jobs Feed - Pipeline refresh for Buid: %s" % buid)
+    stats = instrument.ImportStats(buid, run='refresh_business_unit')
+    solr_requests = _solr_requests()
+    feed = None
+    reader = None
+
+    with stats.timer('download'):
+        if download and direct:
+            reader = open_feed_stream(buid, conditional=conditional,
+                                      keep_copy=keep_copy)
+
+            if reader is None:
+                logging.info("BUID:%s - Feed file unchanged, skipping." %
+                             buid)
+                return {'database': None, 'solr': None, 'unchanged': True}
+
+            feed = reader.source
+            filepath = reader
+            stream = True
+        elif download and conditional:
+            feed = fetch_feed_file(buid, reuse_key=reuse_key)
+
+            if not feed.changed:
+                logging.info("BUID:%s - Feed file unchanged, skipping." %
+                             buid)
+                return {'database': None, 'solr': None, 'unchanged': True}
+
+            filepath = feed.path
+        elif download:
+            filepath = store_feed_file(buid, reuse_key=reuse_key)
+        else:
+            filepath = os.path.join(DATA_DIR, FEED_FILE_PREFIX + str(buid) +
+                                    '.xml')
+
+    if reader is None:
+        stats.count('bytes', os.path.getsize(filepath))
+
+    # A file in the feed store is leased so that it isn't evicted while
+    # it is being read.
+    with feed_store.lease(filepath), stats.count_queries():
+        try:
+            with stats.timer('open'):
+                jobfeed = xmlparse.DEv2JobFeed(
+                    filepath, stream=stream,
+                    deterministic_salt=deterministic_salt)
+            db_results, solr_results = process_feed(jobfeed, [
+                DatabaseSink(buid, update_all=update_all,
+                             skip_unchanged=skip_unchanged, bulk=True),
+                SolrSink(buid, force=force, set_title=set_title,
+                         skip_unchanged=skip_unchanged)
+            ], stats=stats)
+
+            if reader is not None and not jobfeed.errors:
+                # Read whatever follows the last job, so that the content
+                # hash of the feed is complete.
+                with stats.timer('parse'):
+                    reader.read()
+        finally:
+            if reader is not None:
+                reader.close()
+
+    changes = bool(db_results['saved'] or db_results['deleted'])
+    _update_business_unit_modified_dates(buid, jobfeed.crawled_date,
+                                         updated=changes)
+
+    if not jobfeed.errors:
+        if reader is None:
+            _discard_feed_file(buid, filepath)
+
+        # Only remember the feed once it has been imported in full, so that
+        # a failed import is retried even if the feed doesn't change.
+        if feed and not (db_results['error'] or solr_results['error']):
+            _update_business_unit_feed(buid, feed)
+
+    if reader is not None:
+        stats.count('bytes', reader.source.size)
+
+    _count_solr_requests(stats, solr_requests)
+    stats.emit()
+    logging.info("Import complete for buid: %s" % buid,
+                 extra={"data": {
+                     "slug cache": slug.stats(),
+                     "solr connections": solrconn.connections.stats(),
+                     "unchanged jobs": db_results['skipped']}})
+    return {'database': db_results, 'solr': solr_results,
+            'unchanged': False}
+
+def refresh_business_units(buids, processes=IMPORT_PROCESSES, **kwargs):
+    """
+    Run `refresh_business_unit` for each of a list of Business Units on a
+    pool of local worker processes. A Business Unit that is already being
+    refreshed, here or elsewhere, is skipped (see `business_unit_lock`).
+
+    Inputs:
+    :buids: A list of Business Unit ids. Each is refreshed once, however
+    many times it is listed.
+    :processes: The number of worker processes; one per CPU if None. If
+    1, the Business Units are refreshed one at a time in this process.
+    Any other keyword arguments are passed to `refresh_business_unit`.
+
+    Returns:
+    A dictionary summarising the run: the number of Business Units
+    'refreshed', 'unchanged', 'skipped' because they were locked, and
+    'failed'; the total number of jobs 'saved' and 'deleted' in the
+    database and 'added' to Solr; 'errors', mapping the id of each
+    Business Unit that failed to a list of its errors; and the 'seconds'
+    the run took.
+
+    The processes of a Celery prefork worker are daemonic and can't start
+    a pool of their own, so this is run from the `refresh_business_units`
+    management command. `tasks.task_refresh_business_units` spreads a
+    batch over the workers instead.
+
+    """
+    start = time.time()
+    buids = list(OrderedDict.fromkeys(buids))
+    args = [(buid, kwargs) for buid in buids]
+    pool = None
+
+    if processes == 1 or len(buids) < 2:
+        results = itertools.imap(_refresh_locked, args)
+    else:
+        # Forked workers must not share this process's database
+        # connection; each opens its own.
+        connection.close()
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_refresh_locked, args)
+
+    try:
+        summary = summarize_refreshes(results)
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    summary['seconds'] = time.time() - start
+    logging.info("Batch refresh complete for %s buids" % len(buids),
+                 extra={"data": summary})
+    return summary
+
+def _refresh_locked(args):
+    buid, kwargs = args
+    return try_refresh_business_unit(buid, **kwargs)
+
+def try_refresh_business_unit(buid, **kwargs):
+    """
+    Refresh a single Business Unit, unless it is locked. Used for each
+    Business Unit of a batch refresh.
+
+    Returns:
+    A 4-tuple of the buid, its status (a key of the summary built by
+    `summarize_refreshes`), its counts and a list of its errors. The
+    errors are strings, so the result can always be sent back from a
+    worker process or a task.
+
+    """
+    counts = {'saved': 0, 'deleted': 0, 'added': 0}
+
+    try:
+        with business_unit_lock(buid) as locked:
+            if not locked:
+                logging.info("BUID:%s - Already being refreshed, skipping."
+                             % buid)
+                return buid, 'skipped', counts, []
+
+            results = refresh_business_unit(buid, **kwargs)
+    except Exception as e:
+        logging.error("BUID:%s - Refresh failed" % buid,
+                      exc_info=sys.exc_info())
+        return buid, 'failed', counts, [repr(e)]
+
+    if results['unchanged']:
+        return buid, 'unchanged', counts, []
+
+    db_results, solr_results = results['database'], results['solr']
+    counts.update(saved=db_results['saved'], deleted=db_results['deleted'],
+                  added=solr_results['added'])
+    errors = [repr(r['error']) for r in (db_results, solr_results)
+              if r['error']]
+    return buid, 'failed' if errors else 'refreshed', counts, errors
+
+def summarize_refreshes(results):
+    """
+    Add up the results of `try_refresh_business_unit` for a batch of
+    Business Units. See `refresh_business_units` for the keys of the
+    summary returned, other than 'seconds'.
+
+    """
+    summary = {'refreshed': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0,
+               'saved': 0, 'deleted': 0, 'added': 0, 'errors': {}}
+
+    for buid, status, counts, errors in results:
+        summary[status] += 1
+
+        for key, value in counts.items():
+            summary[key] += value
+
+        if errors:
+            summary['errors'][buid] = errors
+
+    return summary
+
+@contextmanager
+def business_unit_lock(buid):
+    """
+    Try to take the lock on a Business Unit. The lock is kept in the
+    Django cache, so it is shared by every process using the same cache
+    and expires after BU_LOCK_TIMEOUT seconds.
+
+    Yields True if the lock was taken, and False if it is held elsewhere.
+    Only a lock that was taken is released.
+
+        >> with business_unit_lock(buid) as locked:
+        >>     if locked:
+        >>         refresh_business_unit(buid)
+
+    """
+    key = "jobparse.bu_lock.%s" % buid
+    token = uuid.uuid4().hex
+    locked = cache.add(key, token, BU_LOCK_TIMEOUT)
+
+    try:
+        yield locked
+    finally:
+        # If the lock expired, it may have been taken by someone else since.
+        if locked and cache.get(key) == token:
+            cache.delete(key)
+
+def refresh_bunit_jobs(buid, download=True, update_all=True, stream=False,
+                       reuse_key=None):
     """
     Writes new and/or updated job data for a particular Business Unit to
     the RDBMS.
@@ -29,121 +341,177 @@ def refresh_bunit_jobs(buid, download=True, update_all=True):
     BusinessUnit id.
     :update_all: Boolean. If 'True', all jobs in the feed file will be
     sent to the database to be updated.
+    :stream: Boolean. If 'True', the feed file is parsed incrementally
+    instead of being loaded into memory as a whole.
+    :reuse_key: Passed to `store_feed_file`.
 
     Returns:
     None
 
     Writes/Modifies:
-    Job data as provided by `import_jobs.parse_feed_file` is used to
-    modify the RDBMS. This includes UPDATE, INSERT and DELETE operations.
+    Job data as provided by `DatabaseSink` is used to modify the RDBMS.
+    This includes UPDATE, INSERT and DELETE operations.
     
     """
     logging.info("XML Jobs Feed - Refresh for Buid: %s" % buid)
-    
-    if download:
-        filepath = download_feed_file(buid)
-    else:
-        filepath = os.path.join(DATA_DIR, FEED_FILE_PREFIX + str(buid) +
-                                '.xml')
-    results = {}
+    stats = instrument.ImportStats(buid, run='refresh_bunit_jobs')
+
+    with stats.timer('download'):
+        if download:
+            filepath = store_feed_file(buid, reuse_key=reuse_key)
+        else:
+            filepath = os.path.join(DATA_DIR, FEED_FILE_PREFIX + str(buid) +
+                                    '.xml')
+    crawled_date = None
     changes = False
     if update_all:
-        results = parse_feed_file(filepath, buid, update_all)
-        # UIDs of jobs in the feed file but not in the database.
-        newjobs = results['jobs_to_save']
-        # UIDs of jobs in the database but not in the feed file.
-        jobs_to_delete = results['deleted_jobs_ids']
-        num_old_jobs = len(jobs_to_delete)
-        changes = bool(newjobs or jobs_to_delete)
-
-        if changes:
-            if newjobs:
-                logging.info("BUID:%s - DB - Updating %s jobs" %
-                             (buid, len(newjobs)))
-                save_jobs(results['jobs_to_save'])
-
-            if num_old_jobs:
-                logging.info("BUID:%s - DB - Deleting %s jobs" %
-                             (buid, num_old_jobs))
-                _remove_old_jobs(jobs_to_delete)
+        stats.count('bytes', os.path.getsize(filepath))
 
-    _update_business_unit_modified_dates(buid, results.get('crawled_date'),
-                                         updated=changes)
-            
+        with feed_store.lease(filepath), stats.count_queries():
+            with stats.timer('open'):
+                jobfeed = xmlparse.DEv2JobFeed(filepath, stream=stream)
+            crawled_date = jobfeed.crawled_date
+            results = process_feed(jobfeed, [DatabaseSink(buid)],
+                                   stats=stats)[0]
+
+        changes = bool(results['saved'] or results['deleted'])
+
+        if not jobfeed.errors:
+            _discard_feed_file(buid, filepath)
+
+    _update_business_unit_modified_dates(buid, crawled_date, updated=changes)
+    stats.emit()
     logging.info("Import complete for buid: %s" % buid)
 
-def _remove_old_jobs(jobs):
+def delete_jobs(uids, buid=None, batch_size=DB_DELETE_CHUNK_SIZE):
+    """
+    Delete the jobs with the given UIDs from the database.
+
+    The jobs are deleted `batch_size` at a time, in UID order, and each
+    batch is committed on its own. That way no single statement holds
+    locks on the table for long, and imports for other business units
+    can carry on in between. A batch that fails is rolled back and
+    skipped.
+
+    If nothing depends on jobListing rows (no related models and no
+    delete signal receivers), each batch is a plain DELETE statement.
+    Otherwise it goes through the ORM, so that cascades and signals
+    still apply.
+
+    Input:
+    :uids: An iterable of job UIDs.
+    :buid: The BusinessUnit the jobs belong to. Only used for logging.
+    :batch_size: The number of jobs to delete per statement.
+
+    Returns:
+    A 2-tuple of the number of jobs deleted and a list of the exceptions
+    raised by the batches that failed.
+
+    """
+    uids = sorted(uids)
+    fast = _can_fast_delete(jobListing)
+    deleted = 0
     errors = []
+
+    for batch in chunked(batch_size, uids):
+        try:
+            deleted += _delete_job_batch(batch, fast)
+        except Exception, e:
+            logging.error("BUID:%s - DB - Could not delete jobs: %s" %
+                          (buid, e))
+            errors.append(e)
+        else:
+            logging.info("BUID:%s - DB - Deleted %s of %s jobs" %
+                         (buid, deleted, len(uids)))
+
+    return deleted, errors
+
+def _can_fast_delete(model):
+    """
+    Return True if rows of `model` can be deleted without Django
+    collecting related objects first.
+
+    """
+    opts = model._meta
+    return not (opts.get_all_related_objects(include_hidden=True) or
+                opts.get_all_related_many_to_many_objects() or
+                opts.many_to_many or opts.virtual_fields or
+                _has_receivers(signals.pre_delete, model) or
+                _has_receivers(signals.post_delete, model))
+
+def _has_receivers(signal, sender):
+    """
+    Return True if anything would receive `signal` sent by `sender`.
+    Signal.has_listeners only exists in Django 1.5 and later.
+
+    """
+    if hasattr(signal, 'has_listeners'):
+        return signal.has_listeners(sender)
+
+    return bool(signal._live_receivers(_make_id(sender)))
+
+@transaction.commit_manually
+def _delete_job_batch(uids, fast):
+    """
+    Delete the jobs with the given UIDs in one transaction and return
+    the number of rows deleted.
+
+    """
     try:
-        jobListing.objects.filter(uid__in=list(jobs)).delete()
-    except Exception, e:
-        errors.append(e)
+        if fast:
+            qn = connection.ops.quote_name
+            sql = "DELETE FROM %s WHERE %s IN (%s)" % (
+                qn(jobListing._meta.db_table),
+                qn(jobListing._meta.get_field('uid').column),
+                ", ".join(["%s"] * len(uids))
+            )
+            cursor = connection.cursor()
+            cursor.execute(sql, uids)
+            count = cursor.rowcount
+        else:
+            jobs = jobListing.objects.filter(uid__in=uids)
+            count = jobs.count()
+            jobs.delete()
+    except:
+        transaction.rollback()
+        raise
 
-    return errors
+    transaction.commit()
+    return count
     
-def parse_feed_file(filepath, buid, update_all_jobs=True):
+def parse_feed_file(filepath, buid, update_all_jobs=True, stream=False):
     """
     Leverage the `xmlparse' module to calculate which jobs to add, delete
-    and/or update in the database.
+    and/or update in the database. Nothing is written; see `DatabaseSink`
+    for a sink that does.
 
     Input:
     :buid: An integer or string. Corresponds to the id of a particular
     Business Unit.
     :update_all_jobs: Boolean. If 'True', all jobs in the feed file will be
     sent to the database to be updated.
+    :stream: Boolean. If 'True', the feed file is parsed incrementally.
 
     Returns:
-    :output: A dictionary.
-
-    """
-    jobfeed = xmlparse.DEv2JobFeed(filepath)
-    output = {
-        # jobListing instances whose UID is in new_jobs_ids
-        'jobs_to_save': [], 
-        # The jobs in the feed file, but not in the database. These jobs
-        # need to be added to the database and to Solr.
-        'new_jobs_ids': set(),
-        # Jobs in the database, but not in the feed file. These jobs need
-        # to be removed from the database and from Solr.
-        'deleted_jobs_ids': set(),
-        # The jobs in the database right now
-        'current_jobs': set(),
-        'crawled_date': jobfeed.crawled_date,
-        'errors': _xml_errors(jobfeed)
-    }
+    :output: A dictionary. See `DatabasePlanSink` for its keys, besides
+    'crawled_date' and 'errors'.
+
+    """
+    jobfeed = xmlparse.DEv2JobFeed(filepath, stream=stream)
+    output = process_feed(jobfeed, [DatabasePlanSink(
+        buid, update_all=update_all_jobs)])[0]
+    error = output.pop('error', None)
+
+    if error is not None:
+        raise error
+
+    output['crawled_date'] = jobfeed.crawled_date
+    output['errors'] = jobfeed.error_messages
 
     # If the feed file did not pass validation, return.
     if jobfeed.errors:
-        error = jobfeed.error_messages
-        logging.error("BUID:%s - Feed file has failed validation on line %s. "
-                      "Exception: %s" % (error['buid'], error['line'],
-                                         error['exception']))
         return output
 
-    jobs = jobfeed.joblist()
-    output['current_jobs'] = set(
-        jobListing.objects.filter(buid=buid).values_list('uid', flat=True)
-    )
-    job_uids = set([long(i.uid) for i in jobs if i.uid])
-    current_jobs = output['current_jobs']
-    output['deleted_jobs_ids'] = current_jobs.difference(job_uids)
-
-    # If update_all_jobs is False, calculate the jobs that are in the feed
-    # file but not in the database. Effectively, this results in an "append-
-    # only" operation, in that only new rows are being added; existing rows
-    # will not be updated with any new information.
-    #
-    # Alternatively, if update_all_jobs is True, every job instance created
-    # by jobfeed.joblist() will be saved to the database, updating all
-    # existing rows and adding new ones.
-    if not update_all_jobs:
-        output['new_jobs_ids'] = job_uids.difference(current_jobs)
-        output['jobs_to_save'] = filter(lambda x: _job_filter(x) in
-                                        output['new_jobs_ids'], jobs)
-    else:
-        output['new_jobs_ids'] = job_uids
-        output['jobs_to_save'] = jobs
-
     logging.info("XML Job Feed Processed for Buid: %s" % buid,
                  extra={
                      "data": {
@@ -151,11 +519,11 @@ def parse_feed_file(filepath, buid, update_all_jobs=True):
                          "date/time": datetime.datetime.utcnow()
                      }
                  })
-    os.remove(filepath)
-    logging.info("BUID:%s - Deleted feed file." % buid)
+    _discard_feed_file(buid, filepath)
     return output
 
-def update_solr(buid, download=True, force=True, set_title=False):
+def update_solr(buid, download=True, force=True, set_title=False,
+                stream=False, reuse_key=None, deterministic_salt=None):
     """
     Update the Solr master index with the data contained in a feed file
     for a given buid/jsid.
@@ -172,6 +540,11 @@ def update_solr(buid, download=True, force=True, set_title=False):
     updated in the index. Otherwise, only the jobs seen in the feed file
     but not seen in the index will be updated. This latter option will
     soon be deprecated.
+    :stream: Boolean. If True, the feed file is parsed incrementally and
+    documents are sent to Solr in chunks as they are read, so the whole
+    feed never has to be held in memory.
+    :reuse_key: Passed to `store_feed_file`.
+    :deterministic_salt: As for `refresh_business_unit`.
 
     Returns:
     A 2-tuple consisting of the number of jobs added and the number deleted.
@@ -183,163 +556,582 @@ def update_solr(buid, download=True, force=True, set_title=False):
     the index, the equivalent of an update operation is performed.)
 
     """
-    if download:
-        filepath = download_feed_file(buid)
-    else:
-        filepath = os.path.join(DATA_DIR, FEED_FILE_PREFIX + str(buid) +
-                                '.xml')
-    jobfeed = xmlparse.DEv2JobFeed(filepath)
+    stats = instrument.ImportStats(buid, run='update_solr')
+    solr_requests = _solr_requests()
+
+    with stats.timer('download'):
+        if download:
+            filepath = store_feed_file(buid, reuse_key=reuse_key)
+        else:
+            filepath = os.path.join(DATA_DIR, FEED_FILE_PREFIX + str(buid) +
+                                    '.xml')
+    stats.count('bytes', os.path.getsize(filepath))
+
+    with feed_store.lease(filepath), stats.count_queries():
+        with stats.timer('open'):
+            jobfeed = xmlparse.DEv2JobFeed(
+                filepath, stream=stream,
+                deterministic_salt=deterministic_salt)
+        # If the feed file did not pass validation, nothing is added or
+        # deleted, so the return value is '(0, 0)'.
+        results = process_feed(jobfeed, [SolrSink(buid, force=force,
+                                                  set_title=set_title)],
+                               stats=stats)[0]
+
+    if not jobfeed.errors:
+        _discard_feed_file(buid, filepath)
+
+    _count_solr_requests(stats, solr_requests)
+    stats.emit()
+    return results['added'], results['deleted']
 
-    # If the feed file did not pass validation, return. The return value is
-    # '(0, 0)' to match what's returned on a successful parse.
+def _solr_requests():
+    """
+    Return the number of requests sent to Solr by this process so far:
+    the calls recorded by the backend if it records them (see
+    `solrconn.MemorySolr`), or else those sent by the pooled connections.
+
+    """
+    calls = getattr(get_solr(), 'calls', None)
+
+    if calls is not None:
+        return len(calls)
+
+    return solrconn.connections.stats()['requests']
+
+def _count_solr_requests(stats, before):
+    """
+    Count the Solr requests sent by this process since `_solr_requests`
+    returned `before`.
+
+    """
+    stats.count('solr_requests', _solr_requests() - before)
+
+def process_feed(jobfeed, sinks, stats=None):
+    """
+    Read every job in a feed exactly once and hand the same job record to
+    each of a list of sinks.
+
+    Inputs:
+    :jobfeed: An `xmlparse.JobFeed` instance.
+    :sinks: A list of `FeedSink` instances.
+    :stats: An `instrument.ImportStats` for the run. The time spent
+    reading the feed and the number of jobs read are recorded in it, and
+    it is handed to each sink to record its own stages in.
+
+    Returns:
+    A list of the results of each sink, in the same order as `sinks`.
+
+    An exception raised by a sink is logged and stored under the 'error'
+    key of its results. That sink is aborted instead of closed, so it
+    won't delete anything; the other sinks carry on. An exception raised
+    while reading the feed aborts every sink and is re-raised.
+
+    """
+    # If the feed file did not pass validation, none of the sinks are run.
     if jobfeed.errors:
-        error = jobfeed.error_messages
-        logging.error("BUID:%s - Feed file has failed validation on line %s. "
-                      "Exception: %s" % (error['buid'], error['line'],
-                                         error['exception']))
-        return (0, 0)
-        
-    bu = BusinessUnit.objects.get(id=buid)
+        _log_feed_errors(jobfeed)
+        return [sink.results for sink in sinks]
 
-    # 'set_title' will be True if this feed file is for a BusinessUnit that's
-    # been newly created by `helpers.create_businessunit` (called from the
-    # `send_sns_confirm` view).
-    if set_title or not bu.title:
-        bu.title = jobfeed.company
-        bu.save()
-
-    # A list of jobListing instances based off the job data in the feed file
-    # for the business unit.
-    jobs = jobfeed.jobparse()
-    # Build a set of all the UIDs for all those instances.
-    job_uids = set([long(i.get('uid')) for i in jobs if i.get('uid')])
-    conn = Solr(settings.HAYSTACK_CONNECTIONS['default']['URL'])
-    step1 = 1024
-
-    # Get the count of all the results in the Solr index for this BUID.
-    hits = conn.search("*:*", fq="buid:%s" % buid, facet="false",
-                       mlt="false").hits
-    # Create (start-index, stop-index) tuples to facilitate handling results
-    # in ``step1``-sized chunks. So if ``hits`` returns 2048 results,
-    # ``job_slices`` will look like ``[(0,1024), (1024, 2048)]``. Those
-    # values are then used to slice up the total results.
-    #
-    # This was put in place because part of the logic to figuring out what
-    # jobs to delete from and add jobs to the Solr index is using set
-    # algebra. We convert the total list of UIDs in the index and the UIDs
-    # in the XML feed to sets, then compare them via ``.difference()``
-    # (seen below). However for very large feed files, say 10,000+ jobs,
-    # this process was taking so long that the connection would time out. To
-    # address this problem we break up the comparisons as described above.
-    # This results in more requests but it alleviates the connection timeout
-    # issue.
-    job_slices = slices(range(hits), step=step1)
-    results = [_solr_results_chunk(tup, buid, step1) for tup in job_slices]
-    solr_uids = reduce(lambda x, y: x|y, results) if results else set()
-    # Return the job UIDs that are in the Solr index but not in the feed
-    # file.
-    solr_del_uids = solr_uids.difference(job_uids)
-
-    if not force:
-        # Return the job UIDs that are in the feed file but not in the Solr
-        # index.
-        solr_add_uids = job_uids.difference(solr_uids)
-        # ``jobfeed.solr_jobs()`` yields a list of dictionaries. We want to
-        # filter out any dictionaries whose "uid" key is not in
-        # ``solr_add_uids``. This is because by default we only want to add
-        # new documents (which each ``solr_jobs()`` dictionary represents),
-        # not update.
-        add_docs = filter(lambda x: int(x.get("uid", 0)) in solr_add_uids,
-                          jobfeed.solr_jobs())
-    else:
-        # This might seem redundant to refer to the same value
-        # twice with two different variable names. However, this decision
-        # was made during the implementation of the "force Solr update"
-        # feature to this function.
+    if stats is None:
+        stats = instrument.ImportStats()
+
+    for sink in sinks:
+        sink.stats = stats
+
+    active = [sink for sink in sinks if _run_sink(sink, 'open', jobfeed)]
+
+    # Each job record is the dictionary built by `jobfeed.job_dict`. Sinks
+    # must not modify it, since it is shared by all of them. Its
+    # fingerprint is worked out once here rather than by each sink.
+    try:
+        start = time.time()
+
+        for job in jobfeed.iterjobs():
+            fingerprint = jobfeed.fingerprint(job)
+            stats.add_time('parse', time.time() - start)
+            stats.count('jobs')
+
+            for sink in list(active):
+                if not _run_sink(sink, 'add', job, fingerprint):
+                    active.remove(sink)
+
+            start = time.time()
+
+        stats.add_time('parse', time.time() - start)
+    except:
+        for sink in active:
+            sink.abort()
+        raise
+
+    # In stream mode, validation errors only surface as the feed file is
+    # read. The jobs handed to the sinks so far are valid, but there is no
+    # way to know which jobs have been removed from the feed, so the sinks
+    # must not delete anything.
+    if jobfeed.errors:
+        _log_feed_errors(jobfeed)
+
+    for sink in active:
+        _run_sink(sink, 'close')
+
+    return [sink.results for sink in sinks]
+
+def _run_sink(sink, method, *args):
+    """
+    Call `method` on `sink`, recording any exception in its results.
+    Returns False if the call failed.
+
+    """
+    try:
+        getattr(sink, method)(*args)
+    except Exception as e:
+        logging.error("BUID:%s - %s failed" % (sink.buid,
+                                               sink.__class__.__name__),
+                      exc_info=sys.exc_info())
+        sink.results['error'] = e
+        sink.abort()
+        return False
+
+    return True
+
+class FeedSink(object):
+    """
+    A destination for the job records read from a feed by `process_feed`.
+
+    Subclasses fill in `results`, a dictionary of counts describing what
+    was written, which is returned by `close`. Its 'error' key is set by
+    `process_feed` if the sink fails. They record the time spent in each
+    stage of their work in `stats`, the `instrument.ImportStats` that
+    `process_feed` shares between the sinks of a run.
+
+    """
+    def __init__(self, buid):
+        self.buid = buid
+        self.jobfeed = None
+        self.results = {'error': None}
+        self.stats = instrument.ImportStats(buid)
+
+    def open(self, jobfeed):
+        """Called once, before any jobs are read from `jobfeed`."""
+        self.jobfeed = jobfeed
+
+    def add(self, job, fingerprint):
+        """
+        Called with the record for each job in the feed, and its
+        fingerprint (see `xmlparse.JobFeed.fingerprint`).
+
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Called once all the jobs have been read. Returns `results`."""
+        return self.results
+
+    def abort(self):
+        """
+        Called instead of `close` if the sink or the feed fails. Releases
+        anything the sink holds without writing anything more. Must not
+        raise.
+
+        """
+        pass
+
+class DatabaseSink(FeedSink):
+    """
+    Writes new and/or updated jobs to the RDBMS in chunks of
+    `DB_STREAM_CHUNK_SIZE`, then deletes the jobs for the business unit
+    that are no longer in the feed.
+
+    Inputs:
+    :update_all: Boolean. If 'True', every job in the feed is saved.
+    Otherwise only the jobs that are not in the database yet are saved.
+    :skip_unchanged: Boolean. If 'True', jobs whose stored content_hash
+    matches the fingerprint of the job in the feed are not saved again.
+    They are counted under 'skipped' in the results.
+    :bulk: Boolean. If 'True', jobs are written with `bulk_save_jobs`
+    instead of `save_jobs`.
+
+    """
+    def __init__(self, buid, update_all=True, skip_unchanged=False,
+                 bulk=False):
+        super(DatabaseSink, self).__init__(buid)
+        self.update_all = update_all
+        self.skip_unchanged = skip_unchanged
+        self.bulk = bulk
+        self.results.update({'saved': 0, 'deleted': 0, 'skipped': 0})
+        self.job_uids = set()
+        # Maps the UID of each job in the database to its content_hash.
+        self.current_jobs = {}
+        self.jobs_to_save = []
+
+    def open(self, jobfeed):
+        super(DatabaseSink, self).open(jobfeed)
+
+        with self.stats.timer('db_diff'):
+            self.current_jobs = dict(
+                jobListing.objects.filter(buid=self.buid).values_list(
+                    'uid', 'content_hash')
+            )
+
+    def add(self, job, fingerprint):
+        with self.stats.timer('db_build'):
+            job = jobListing(content_hash=fingerprint, **job)
+            uid = _job_filter(job)
+
+            if uid:
+                self.job_uids.add(uid)
+
+            if (self.skip_unchanged and uid in self.current_jobs and
+                    self.current_jobs[uid] == job.content_hash):
+                self.results['skipped'] += 1
+            elif self.update_all or (uid and uid not in self.current_jobs):
+                self.jobs_to_save.append(job)
+
+        if len(self.jobs_to_save) == DB_STREAM_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.jobs_to_save:
+            logging.info("BUID:%s - DB - Updating %s jobs" %
+                         (self.buid, len(self.jobs_to_save)))
+            save = bulk_save_jobs if self.bulk else save_jobs
+
+            with self.stats.timer('db_write'):
+                self.results['saved'] += len(save(self.jobs_to_save))
+
+            self.jobs_to_save = []
+
+    def close(self):
+        self.flush()
+
+        if not self.jobfeed.errors:
+            # UIDs of jobs in the database but not in the feed file.
+            with self.stats.timer('db_diff'):
+                jobs_to_delete = set(self.current_jobs).difference(
+                    self.job_uids)
+
+            if jobs_to_delete:
+                logging.info("BUID:%s - DB - Deleting %s jobs" %
+                             (self.buid, len(jobs_to_delete)))
+
+                with self.stats.timer('db_write'):
+                    self.results['deleted'] = delete_jobs(jobs_to_delete,
+                                                          buid=self.buid)[0]
+
+        return self.results
+
+class DatabasePlanSink(FeedSink):
+    """
+    Works out which jobs `DatabaseSink` would save and delete, without
+    writing anything. Used by `parse_feed_file`.
+
+    Inputs:
+    :update_all: Boolean. As for `DatabaseSink`.
+
+    """
+    def __init__(self, buid, update_all=True):
+        super(DatabasePlanSink, self).__init__(buid)
+        self.update_all = update_all
+        self.results.update({
+            # jobListing instances whose UID is in new_jobs_ids
+            'jobs_to_save': [],
+            # The jobs in the feed file, but not in the database (or all
+            # the jobs in the feed file, if update_all is True). These jobs
+            # need to be added to the database and to Solr.
+            'new_jobs_ids': set(),
+            # Jobs in the database, but not in the feed file. These jobs
+            # need to be removed from the database and from Solr.
+            'deleted_jobs_ids': set(),
+            # The jobs in the database right now
+            'current_jobs': set()
+        })
+        self.job_uids = set()
+
+    def open(self, jobfeed):
+        super(DatabasePlanSink, self).open(jobfeed)
+        self.results['current_jobs'] = set(
+            jobListing.objects.filter(buid=self.buid).values_list(
+                'uid', flat=True)
+        )
+
+    def add(self, job, fingerprint):
+        job = jobListing(content_hash=fingerprint, **job)
+        uid = _job_filter(job)
+
+        if uid:
+            self.job_uids.add(uid)
+
+        if self.update_all or (uid and
+                               uid not in self.results['current_jobs']):
+            if uid:
+                self.results['new_jobs_ids'].add(uid)
+
+            self.results['jobs_to_save'].append(job)
+
+    def close(self):
+        # See `process_feed` for why nothing is deleted if the feed failed
+        # validation part way through.
+        if not self.jobfeed.errors:
+            self.results['deleted_jobs_ids'] = (
+                self.results['current_jobs'].difference(self.job_uids))
+
+        return self.results
+
+class SolrSink(FeedSink):
+    """
+    Adds documents built by `jobfeed.solr_job_dict` to the Solr index in
+    chunks, then deletes the documents for the business unit that are no
+    longer in the feed. See `update_solr` for the meaning of `force` and
+    `set_title`.
+
+    If `skip_unchanged` is True, documents whose content_hash in the index
+    matches the `solr_fingerprint` of the job in the feed are not sent
+    again. They are counted under 'skipped' in the results.
+
+    """
+    def __init__(self, buid, force=True, set_title=False,
+                 skip_unchanged=False):
+        super(SolrSink, self).__init__(buid)
+        self.force = force
+        self.set_title = set_title
+        self.skip_unchanged = skip_unchanged
+        self.results.update({'added': 0, 'deleted': 0, 'skipped': 0})
+        self.job_uids = set()
+        # Maps the UID of each document in the index to its content_hash.
+        self.solr_uids = {}
+        self.batcher = solrconn.SolrBatcher(
+            target_bytes=getattr(settings, 'SOLR_BATCH_BYTES',
+                                 4 * 1024 * 1024),
+            target_seconds=getattr(settings, 'SOLR_BATCH_SECONDS', 5.0)
+        )
+        self.conn = None
+        self.writer = None
+
+    def open(self, jobfeed):
+        super(SolrSink, self).open(jobfeed)
+        bu = BusinessUnit.objects.get(id=self.buid)
+
+        # 'set_title' will be True if this feed file is for a BusinessUnit
+        # that's been newly created by `helpers.create_businessunit` (called
+        # from the `send_sns_confirm` view).
+        if self.set_title or not bu.title:
+            bu.title = jobfeed.company
+            bu.save()
+
+        with self.stats.timer('moc'):
+            xmlparse.moc_index.refresh()
+
+        self.conn = get_solr()
+
+        with self.stats.timer('solr_diff'):
+            self.solr_uids = _solr_uids(self.conn, self.buid)
+        # Chunks are sent from other threads while the feed is still being
+        # read, rather than making the feed wait on each round trip.
+        self.writer = solrconn.SolrWriter(self.conn,
+                                          callback=self.request_done)
+
+    def add(self, job, fingerprint):
+        with self.stats.timer('solr_build'):
+            docs = self._add(job, fingerprint)
+
+        if docs:
+            with self.stats.timer('solr_write'):
+                self.send(docs)
+
+    def _add(self, job, fingerprint):
+        """
+        Record `job`, and return the batch of documents to send if adding
+        its document completed one.
+
+        """
+        uid = long(job['uid']) if job.get('uid') else None
+
+        if uid:
+            self.job_uids.add(uid)
+
+        # If ``force`` is False, we only want to add the jobs that are in the
+        # feed file but not in the Solr index. This latter option will soon
+        # be deprecated.
         #
-        # Instead of adding only the documents with UIDs that are in the feed
-        # file but not in the Solr index, we're going to add ALL the documents
-        # in the feed file. This will add the new documents of course, but it
-        # will also update existing documents with any new data. Uniqueness of
-        # the documents is ensured by the ``id`` field defined in the Solr
-        # schema (the template for which can be seen in
-        # templates/search_configuration/solr.xml). At the very bottom you'll
-        # see <uniqueKey>id</uniqueKey>. This serves as the equivalent of the pk
-        # (i.e. globally unique) in a database.
-        solr_add_uids = job_uids
-        add_docs = jobfeed.solr_jobs()
-        
-    # Slice up ``add_docs`` in chunks of 4096. This is because the
-    # maxBooleanClauses setting in solrconfig.xml is set to 4096. This means
-    # if we used any more than that Solr would throw an error and our
-    # updates wouldn't get processed.
-    add_steps = slices(range(len(solr_add_uids)), step=4096)
-    # Same concept as ``add_docs``.
-    del_steps = slices(range(len(solr_del_uids)), step=4096)
-    # Create a generator that yields 2-tuples with each invocation. The
-    # 2-tuples consist of one tuple each from del_steps & add_steps. Any
-    # mismatched values (e.g. there are more del_steps than add_steps)
-    # will be compensated for with the ``fillvalue``.
-    zipped_steps = izip_longest(del_steps, add_steps, fillvalue=(0,0))
-    
-    for tup in zipped_steps:
-        update_chunk = add_docs[tup[1][0]:tup[1][1]+1]
+        # Otherwise we add ALL the documents in the feed file. This will add
+        # the new documents of course, but it will also update existing
+        # documents with any new data. Uniqueness of the documents is ensured
+        # by the ``id`` field defined in the Solr schema (the template for
+        # which can be seen in templates/search_configuration/solr.xml). At
+        # the very bottom you'll see <uniqueKey>id</uniqueKey>. This serves
+        # as the equivalent of the pk (i.e. globally unique) in a database.
+        # Documents also hold the job's MOCs, which can change without the
+        # feed changing, so they are compared by their own hash.
+        content_hash = self.jobfeed.solr_fingerprint(job, fingerprint)
+
+        if (self.skip_unchanged and uid in self.solr_uids and
+                self.solr_uids[uid] == content_hash):
+            self.results['skipped'] += 1
+        elif self.force or (uid and uid not in self.solr_uids):
+            # Documents are sent in batches of roughly the same size in
+            # bytes, however long their descriptions are. See
+            # `solrconn.SolrBatcher`.
+            return self.batcher.add(self.jobfeed.solr_job_dict(job,
+                                                               content_hash))
 
-        if update_chunk:
-            logging.info("BUID:%s - SOLR - Update chunk: %s" %
-                         (buid, [i['uid'] for i in update_chunk]))
+    def flush(self):
+        self.send(self.batcher.flush())
+
+    def send(self, docs):
+        if docs:
+            logging.info("BUID:%s - SOLR - Update chunk: %s docs" %
+                         (self.buid, len(docs)))
             # Pass 'commitWithin' so that Solr doesn't try to commit the new
             # docs right away. This will help relieve some of the resource
             # stress during the daily update. The value is expressed in
             # milliseconds.
-            conn.add(update_chunk, commitWithin="30000")
+            self.writer.add(docs, commitWithin="30000")
+            self.results['added'] += len(docs)
+
+    def request_done(self, method, size, seconds):
+        """Called by the writer after each request Solr has answered."""
+        if method == 'add':
+            self.batcher.record(seconds)
+
+    def close(self):
+        with self.stats.timer('solr_write'):
+            return self._close()
+
+    def _close(self):
+        solr_del_uids = set()
+
+        try:
+            self.flush()
+
+            if not self.jobfeed.errors:
+                # The job UIDs that are in the Solr index but not in the
+                # feed file.
+                solr_del_uids = set(self.solr_uids).difference(self.job_uids)
+                del_ids = ['seo.joblisting.%s' % uid
+                           for uid in sorted(solr_del_uids)]
+
+                # Delete by uniqueKey (see `solr_job_dict`), in chunks so
+                # that no single request gets too large. The writer
+                # doesn't send these until all the adds above have gone
+                # through.
+                for chunk in chunked(SOLR_DELETE_CHUNK_SIZE, del_ids):
+                    logging.info("BUID:%s - SOLR - Delete chunk: %s docs" %
+                                 (self.buid, len(chunk)))
+                    self.writer.delete_ids(chunk)
+        finally:
+            self.writer.close()
+
+        self.results['deleted'] = len(solr_del_uids)
+        self.results['latency'] = self.writer.stats()
+        return self.results
+
+    def abort(self):
+        if self.writer is not None:
+            try:
+                self.writer.close()
+            except Exception:
+                pass
+
+def get_solr():
+    """
+    Return the Solr client that imports send their requests to.
+
+    This is the pooled client from `solrconn.connections`, unless another
+    backend has been set with `set_solr_backend` or is named by the
+    SOLR_BACKEND setting, e.g. 'jobparse.solrconn.MemorySolr' to keep the
+    index in memory. A backend needs the `search`, `add`, `delete` and
+    `_update` methods of `pysolr.Solr`, as used here and by
+    `solrconn.delete_ids`. If it also has a `calls` list, its length is
+    counted as the requests sent (see `_solr_requests`).
+
+    """
+    global _solr_backend
+
+    if _solr_backend is None:
+        path = getattr(settings, 'SOLR_BACKEND', None)
+
+        if path is None:
+            return solrconn.connections.get()
+
+        module, name = path.rsplit('.', 1)
+        _solr_backend = getattr(import_module(module), name)()
+
+    return _solr_backend
 
-        delete_chunk = _build_solr_delete_query(list(solr_del_uids)[tup[0][0]:\
-                                                                    tup[0][1]+1])
+def set_solr_backend(backend):
+    """
+    Make imports send their Solr requests to `backend` (None restores the
+    default; see `get_solr`). Returns the backend set before.
+
+    """
+    global _solr_backend
+    old, _solr_backend = _solr_backend, backend
+    return old
+
+def _solr_uids(conn, buid):
+    """
+    Return a dictionary mapping the UID of each job in the Solr index for
+    a BU to its content_hash (None for documents indexed without one).
+
+    """
+    return dict((doc['uid'], doc.get('content_hash'))
+                for doc in _iter_solr_docs(conn, buid, "uid,content_hash"))
+
+def iter_solr_uids(conn, buid, rows=SOLR_UID_PAGE_SIZE):
+    """
+    Yield the UID of each job in the Solr index for a BU, in ascending
+    order, fetching them `rows` at a time.
+
+    """
+    for doc in _iter_solr_docs(conn, buid, "uid", rows):
+        yield doc['uid']
 
-        if delete_chunk:
-            logging.info("BUID:%s - SOLR - Delete chunk: %s" %
-                         (buid, list(solr_del_uids)))
-            conn.delete(q=delete_chunk)
+def _iter_solr_docs(conn, buid, fl, rows=SOLR_UID_PAGE_SIZE):
+    """
+    Yield the `fl` fields of every document in the Solr index for a BU,
+    sorted on uid.
+
+    Rather than paging with `start`, which makes Solr collect and skip
+    every document before the page and so gets slower the deeper it
+    goes, each page asks for the documents whose uid is greater than the
+    last one seen. Every page costs the same, however large the BU.
+
+    """
+    q = "*:*"
+
+    while True:
+        docs = conn.search(q, fq="buid:%s" % buid, fl=fl, sort="uid asc",
+                           rows=rows, facet="false", mlt="false").docs
+
+        for doc in docs:
+            yield doc
 
-    os.remove(filepath)
-    logging.info("BUID:%s - Deleted feed file." % buid)
-    return len(solr_add_uids), len(solr_del_uids)
+        if len(docs) < rows:
+            break
+
+        q = "uid:{%s TO *}" % docs[-1]['uid']
+
+def _log_feed_errors(jobfeed):
+    error = jobfeed.error_messages
+    logging.error("BUID:%s - Feed file has failed validation on line %s. "
+                  "Exception: %s" % (error['buid'], error['line'],
+                                     error['exception']))
 
 def clear_solr(buid):
     """Delete all jobs for a given business unit/job source."""
-    conn = Solr(settings.HAYSTACK_CONNECTIONS['default']['URL'])
+    conn = get_solr()
     hits = conn.search(q="*:*", rows=1, mlt="false", facet="false").hits
     logging.info("BUID:%s - SOLR - Deleting all %s jobs" % (buid, hits))
     conn.delete(q="buid:%s" % buid)
+    # So that the next refresh imports the feed again, even if it hasn't
+    # changed.
+    _forget_business_unit_feed(buid)
     logging.info("BUID:%s - SOLR - All jobs deleted." % buid)
 
-def _solr_results_chunk(tup, buid, step):
-    """
-    Takes a (start_index, stop_index) tuple and gets the results in that
-    range from the Solr index.
-
-    """
-    conn = Solr(settings.HAYSTACK_CONNECTIONS['default']['URL'])
-    results = conn.search("*:*", fq="buid:%s" % buid, fl="uid",
-                          rows=step, start=tup[0], facet="false",
-                          mlt="false").docs
-    return set([i['uid'] for i in results])
-    
 def _job_filter(job):
     if job.uid:
         return long(job.uid)
 
-def _xml_errors(jobfeed):
-    """
-    Checks XML input for errors, and logs any it finds.
-
-    """
-    if jobfeed.errors:
-        logging.error("XML Job Feed Error",
-                      extra={'data': jobfeed.error_messages})
-    return jobfeed.error_messages
-
 @transaction.commit_manually
 def save_jobs(jobs):
     """
@@ -377,6 +1169,94 @@ def save_jobs(jobs):
     transaction.commit()
     return saved_jobs
 
+@transaction.commit_manually
+def bulk_save_jobs(jobs):
+    """
+    Like `save_jobs`, but writes the jobs a batch at a time instead of
+    with a query (or two) per job.
+
+    The ids of the jobs already in the database are looked up a chunk of
+    `DB_LOOKUP_CHUNK_SIZE` uids at a time. New jobs are inserted with
+    `bulk_create` and existing ones are updated with a single
+    `executemany` call. Neither calls `jobListing.save`, so the derived
+    fields it would fill in are set beforehand with
+    `jobListing.set_derived_fields`.
+
+    If a batch fails, it is rolled back and its jobs are handed to
+    `save_jobs`, so that one bad job doesn't lose the rest.
+
+    Input:
+    :jobs: A list of unsaved jobListing instances.
+
+    Returns:
+    :saved_jobs: A list of jobListing instances.
+
+    """
+    jobs = [job for job in jobs if _job_filter(job)]
+    new_jobs = []
+    old_jobs = []
+
+    try:
+        existing = {}
+
+        for batch in chunked(DB_LOOKUP_CHUNK_SIZE,
+                             [_job_filter(job) for job in jobs]):
+            existing.update(jobListing.objects.filter(
+                uid__in=batch).values_list('uid', 'id'))
+
+        for job in jobs:
+            job.set_derived_fields()
+            job.id = existing.get(_job_filter(job))
+
+            if job.id is None:
+                new_jobs.append(job)
+            else:
+                old_jobs.append(job)
+
+        # bulk_create only takes a batch_size from Django 1.5 on.
+        for batch in chunked(_bulk_batch_size(), new_jobs):
+            jobListing.objects.bulk_create(batch)
+
+        _bulk_update_jobs(old_jobs)
+    except Exception as e:
+        transaction.rollback()
+        logging.info(e)
+        return save_jobs(jobs)
+
+    transaction.commit()
+    return jobs
+
+def _bulk_batch_size():
+    """
+    Return the number of jobs to insert per statement: DB_STREAM_CHUNK_SIZE,
+    or fewer on SQLite, which allows at most 999 parameters in a query.
+
+    """
+    if connection.vendor == 'sqlite':
+        return max(999 // len(jobListing._meta.local_fields), 1)
+
+    return DB_STREAM_CHUNK_SIZE
+
+def _bulk_update_jobs(jobs):
+    """
+    Update the rows of existing jobs with one UPDATE statement executed
+    for every job in `jobs`. Each job must already have its `id` set.
+
+    """
+    if not jobs:
+        return
+
+    qn = connection.ops.quote_name
+    fields = [f for f in jobListing._meta.local_fields if not f.primary_key]
+    sql = "UPDATE %s SET %s WHERE %s = %%s" % (
+        qn(jobListing._meta.db_table),
+        ", ".join("%s = %%s" % qn(f.column) for f in fields),
+        qn(jobListing._meta.pk.column)
+    )
+    rows = [[f.get_db_prep_save(f.pre_save(job, False), connection=connection)
+             for f in fields] + [job.id] for job in jobs]
+    connection.cursor().executemany(sql, rows)
+
 def download_feed_file(buid):
     '''
     Downloads the job feed data for a particular job source id.
@@ -386,10 +1266,150 @@ def download_feed_file(buid):
                                   '.xml')
     # Download new feed file for today
     logging.info("Downloading new file for BUID %s..." % buid)
-    urllib.urlretrieve(generate_feed_url(buid), full_file_path)
+    feeddownload.fetch(generate_feed_url(buid), full_file_path)
     logging.info("Download complete for BUID %s" % buid)
     return full_file_path
 
+def store_feed_file(buid, reuse_key=None):
+    """
+    Download the feed file for a Business Unit into the feed store and
+    return its path.
+
+    If `reuse_key` is given, the download is stored under it, and a copy
+    already stored under it is returned instead of downloading the feed
+    again. Pass the same key (e.g. the id of a task, which a retry keeps)
+    from each attempt at the same import; a new import should never get
+    an old copy, since the feed may have been republished since.
+
+    """
+    path = None
+
+    if reuse_key is not None:
+        path = feed_store.latest(buid, reuse_key=reuse_key)
+
+    if path is None:
+        logging.info("Downloading new file for BUID %s..." % buid)
+        feed = feeddownload.fetch(generate_feed_url(buid),
+                                  feed_store.partial_path(buid))
+        path = feed_store.add(buid, feed.path, content_hash=feed.content_hash,
+                              etag=feed.etag,
+                              last_modified=feed.last_modified,
+                              reuse_key=reuse_key)
+        logging.info("Download complete for BUID %s" % buid)
+
+    return path
+
+def fetch_feed_file(buid, reuse_key=None):
+    """
+    Download the feed file for a Business Unit into the feed store,
+    unless it is the same as the last one imported for it (as recorded by
+    `_update_business_unit_feed`).
+
+    The request carries the ETag and Last-Modified values of the last feed
+    imported, so the server can answer 304 without sending anything. If
+    it sends the feed anyway, its content hash is compared with the
+    stored one. A copy stored under `reuse_key` is used instead of asking
+    the server, as in `store_feed_file`.
+
+    Returns:
+    A `download.FeedDownload`. Its 'path' is the feed file in the feed
+    store if the feed has changed, and None otherwise.
+
+    """
+    bu = BusinessUnit.objects.get(id=buid)
+    path = None
+
+    if reuse_key is not None:
+        path = feed_store.latest(buid, reuse_key=reuse_key)
+
+    if path is not None:
+        info = feed_store.info(path)
+        changed = info['content_hash'] != bu.feed_hash
+        return feeddownload.FeedDownload(path if changed else None, changed,
+                                         info.get('etag'),
+                                         info.get('last_modified'),
+                                         info['content_hash'])
+
+    logging.info("Fetching feed file for BUID %s..." % buid)
+    feed = feeddownload.fetch(generate_feed_url(buid),
+                              feed_store.partial_path(buid),
+                              etag=bu.feed_etag,
+                              last_modified=bu.feed_last_modified,
+                              content_hash=bu.feed_hash)
+
+    if not feed.changed:
+        if feed.path:
+            os.remove(feed.path)
+
+        return feed._replace(path=None)
+
+    path = feed_store.add(buid, feed.path, content_hash=feed.content_hash,
+                          etag=feed.etag, last_modified=feed.last_modified,
+                          reuse_key=reuse_key)
+    return feed._replace(path=path)
+
+def open_feed_stream(buid, conditional=True, keep_copy=False):
+    """
+    Start downloading the feed file for a Business Unit, to be parsed as
+    it arrives.
+
+    Inputs:
+    :conditional: Boolean. If True, the request carries the ETag and
+    Last-Modified values of the last feed imported (see
+    `fetch_feed_file`).
+    :keep_copy: Boolean. If True, the feed is also saved to DATA_DIR.
+
+    Returns:
+    A `download.PrefetchReader` over the feed, or None if the server
+    answered that it hasn't changed. Its 'source' is the underlying
+    `download.FeedResponse`.
+
+    """
+    validators = {}
+
+    if conditional:
+        bu = BusinessUnit.objects.get(id=buid)
+        validators = {'etag': bu.feed_etag,
+                      'last_modified': bu.feed_last_modified}
+
+    logging.info("Streaming feed file for BUID %s..." % buid)
+    feed = feeddownload.open_feed(generate_feed_url(buid), **validators)
+
+    if feed is None:
+        return None
+
+    copy_path = None
+
+    if keep_copy:
+        copy_path = os.path.join(DATA_DIR, FEED_FILE_PREFIX + str(buid) +
+                                 '.xml')
+
+    return feeddownload.PrefetchReader(feed, copy_path=copy_path)
+
+def _discard_feed_file(buid, filepath):
+    """
+    Delete a feed file that has been imported. Files in the feed store are
+    left for it to evict, since another task may still want them.
+
+    """
+    if not feed_store.contains(filepath):
+        os.remove(filepath)
+        logging.info("BUID:%s - Deleted feed file." % buid)
+
+def _update_business_unit_feed(buid, feed):
+    BusinessUnit.objects.filter(id=buid).update(
+        feed_etag=feed.etag, feed_last_modified=feed.last_modified,
+        feed_hash=feed.content_hash)
+
+def _forget_business_unit_feed(buid):
+    """
+    Forget the last feed imported for a Business Unit, so that the next
+    conditional refresh imports the feed whether or not it has changed.
+
+    """
+    BusinessUnit.objects.filter(id=buid).update(
+        feed_etag=None, feed_last_modified=None, feed_hash=None)
+
 def _has_errors(doc):
     has_errors = False
     errors = etree.iterparse(doc, tag='error')
@@ -467,9 +1487,11 @@ def clear_jobs(buid):
     String reporting status of command.
     
     """
-    j = jobListing.objects.filter(buid=buid).delete()
+    uids = jobListing.objects.filter(buid=buid).values_list('uid', flat=True)
+    delete_jobs(uids, buid=buid)
     bu = BusinessUnit.objects.get(id=buid)
     bu.save()
+    _forget_business_unit_feed(buid)
 
     logging.info("XML Job Feed - Jobs cleared for Buid: %s" % buid)
     return "All jobs for buid %s cleared from system" % (str(buid))
@@ -482,12 +1504,3 @@ def generate_feed_url(buid, task=None):
         the_url += '&task=%s' % task
     return the_url
 
-def _build_solr_delete_query(old_jobs):
-    if old_jobs:
-        delete_query = ("uid:(%s)" % " OR "\
-                            .join([str(x) for x in old_jobs]))
-    else:
-        delete_query = None
-
-    return delete_query
-
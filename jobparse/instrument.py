@@ -0,0 +1,163 @@
+"""
+Timing and throughput figures for feed imports.
+
+An `ImportStats` is kept for each run of `import_jobs.refresh_business_unit`,
+`refresh_bunit_jobs` or `update_solr` over a Business Unit. It adds up the
+seconds spent in each stage of the run:
+
+    download    Downloading the feed file.
+    open        Reading the feed header. When the feed isn't streamed,
+                this also parses and validates the whole file.
+    parse       Reading the jobs from the feed and fingerprinting them.
+                When the feed is streamed, the schema is checked as it
+                is read, so this includes validation.
+    moc         Loading the MOC index (see `xmlparse.MocIndex`).
+    db_diff     Loading the jobs already in the database and working out
+                which to delete.
+    db_build    Building the jobListing instances.
+    db_write    Saving and deleting jobs.
+    solr_diff   Loading the documents already in the Solr index.
+    solr_build  Building the Solr documents.
+    solr_write  Sending documents and deletes to Solr, including waiting
+                for the writer to catch up.
+
+It also counts the 'jobs' read, the 'bytes' of feed read, and the
+'db_queries' and 'solr_requests' made. Once the run is over, `emit`
+passes a record of all this to each of the hooks named by the
+IMPORT_STATS_HOOKS setting; by default `log_record`, which logs it.
+
+"""
+import logging
+import sys
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.importlib import import_module
+
+
+class ImportStats(object):
+    """
+    Inputs:
+    :buid: The id of the Business Unit being imported.
+    :run: A string naming the kind of run, e.g. 'update_solr'.
+
+    """
+    def __init__(self, buid=None, run=None):
+        self.buid = buid
+        self.run = run
+        self.started = time.time()
+        self.stages = {}
+        self.counts = {}
+
+    @contextmanager
+    def timer(self, stage):
+        """Add the time spent in the block to `stage`."""
+        start = time.time()
+
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.time() - start)
+
+    def add_time(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    @contextmanager
+    def count_queries(self):
+        """
+        Count the database queries made in the block under 'db_queries'.
+
+        The cursors opened in the block are wrapped so that they count
+        queries as they run, without keeping the SQL of each, so that a
+        long import doesn't hold every query in memory. The cursor the
+        backend returns is otherwise used as is.
+
+        """
+        db = connections[DEFAULT_DB_ALIAS]
+        self.count('db_queries', 0)
+        cursor = db.cursor
+        db.cursor = lambda: _CountingCursor(cursor(), self)
+
+        try:
+            yield
+        finally:
+            del db.cursor
+
+    def record(self):
+        """
+        Return a dictionary of the figures for the run so far, including
+        the jobs and bytes read per second over the whole run.
+
+        """
+        seconds = time.time() - self.started
+        rate = lambda n: n / seconds if seconds else 0.0
+        return {'buid': self.buid, 'run': self.run, 'seconds': seconds,
+                'stages': dict(self.stages), 'counts': dict(self.counts),
+                'jobs_per_second': rate(self.counts.get('jobs', 0)),
+                'bytes_per_second': rate(self.counts.get('bytes', 0))}
+
+    def emit(self):
+        """
+        Pass the record of the run to each hook, and return it. A hook
+        that raises is logged and doesn't stop the others.
+
+        """
+        record = self.record()
+
+        for hook in get_hooks():
+            try:
+                hook(record)
+            except Exception:
+                logging.error("Import stats hook %r failed" % hook,
+                              exc_info=sys.exc_info())
+
+        return record
+
+
+class _CountingCursor(object):
+    """
+    Wraps a cursor, counting the queries run through it in `stats`.
+    Everything else is handed to the wrapped cursor.
+
+    """
+    def __init__(self, cursor, stats):
+        self.cursor = cursor
+        self.stats = stats
+
+    def execute(self, *args, **kwargs):
+        self.stats.count('db_queries')
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.stats.count('db_queries')
+        return self.cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def get_hooks():
+    """Return the functions named by the IMPORT_STATS_HOOKS setting."""
+    hooks = []
+
+    for path in getattr(settings, 'IMPORT_STATS_HOOKS',
+                        ['jobparse.instrument.log_record']):
+        module, name = path.rsplit('.', 1)
+        hooks.append(getattr(import_module(module), name))
+
+    return hooks
+
+
+def log_record(record):
+    """The default hook: log the record as structured data."""
+    logging.info("Import stats for buid %s (%s)" % (record['buid'],
+                                                    record['run']),
+                 extra={"data": record})
@@ -0,0 +1,270 @@
+"""
+Benchmarks for parsing feeds and writing the jobs in them.
+
+Each benchmark is run over a feed of each size written by `feedgen`, and
+reports the seconds it took and the jobs per second that makes. The
+database is a throwaway test database (SQLite in memory with the test
+settings) and Solr is replaced by `solrconn.MemorySolr`, so nothing but
+the local machine is needed.
+
+From a project that uses jobparse:
+
+    python manage.py benchmark_import --sizes 1000,10000
+
+The speed of some benchmarks relative to others is checked against the
+targets in TARGETS, which hold on any machine, and the command fails if
+one is missed. Timings can also be kept in a baseline file with --save
+and compared with it later with --baseline; the command then also fails
+if any benchmark is more than --tolerance slower. Timings only compare
+on the same machine, so a baseline is not shipped with jobparse.
+
+"""
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from jobparse import import_jobs, xmlparse
+from jobparse.helpers import chunked
+from jobparse.models import jobListing
+from jobparse.solrconn import MemorySolr
+from jobparse.tests import feedgen
+from jobparse.tests.factories import BusinessUnitFactory
+
+SIZES = [1000, 10000, 100000, 1000000]
+BUID = 1
+# (benchmark, benchmark it is compared with, least ratio of their jobs per
+# second). `bulk_save_jobs` is meant to write at least ten times as fast as
+# `save_jobs`.
+TARGETS = [
+    ('bulk_save_jobs', 'save_jobs', 10.0),
+]
+
+
+def bench_parse(path, buid):
+    """Read every job from the feed, streaming it."""
+    start = time.time()
+
+    for job in xmlparse.DEv2JobFeed(path, stream=True).iterjobs():
+        pass
+
+    return time.time() - start
+
+
+def bench_solr_job_dict(path, buid):
+    """Build the Solr document for every job in the feed."""
+    jobfeed = xmlparse.DEv2JobFeed(path, stream=True)
+    xmlparse.moc_index.refresh()
+    seconds = 0
+
+    for job in jobfeed.iterjobs():
+        start = time.time()
+        jobfeed.solr_job_dict(job)
+        seconds += time.time() - start
+
+    return seconds
+
+
+def _save_benchmark(save):
+    def bench(path, buid):
+        jobfeed = xmlparse.DEv2JobFeed(path, stream=True)
+        seconds = 0
+
+        for chunk in chunked(import_jobs.DB_STREAM_CHUNK_SIZE,
+                             jobfeed.iterjobs()):
+            jobs = [jobListing(**job) for job in chunk]
+            start = time.time()
+            save(jobs)
+            seconds += time.time() - start
+
+        import_jobs.clear_jobs(buid)
+        return seconds
+
+    bench.__doc__ = "Insert every job in the feed with `%s`." % save.__name__
+    return bench
+
+
+bench_save_jobs = _save_benchmark(import_jobs.save_jobs)
+bench_bulk_save_jobs = _save_benchmark(import_jobs.bulk_save_jobs)
+
+
+def bench_update_solr(path, buid):
+    """Add every job in the feed to an empty index with `update_solr`."""
+    shutil.copyfile(path, os.path.join(
+        settings.DATA_DIR, import_jobs.FEED_FILE_PREFIX + str(buid) + '.xml'))
+    # Only the fields `update_solr` reads back are kept, so that a million
+    # documents fit in memory.
+    old = import_jobs.set_solr_backend(MemorySolr(
+        fields=('id', 'buid', 'uid', 'content_hash')))
+
+    try:
+        start = time.time()
+        import_jobs.update_solr(buid, download=False, stream=True)
+        return time.time() - start
+    finally:
+        import_jobs.set_solr_backend(old)
+
+
+BENCHMARKS = [
+    ('parse', bench_parse),
+    ('solr_job_dict', bench_solr_job_dict),
+    ('save_jobs', bench_save_jobs),
+    ('bulk_save_jobs', bench_bulk_save_jobs),
+    ('update_solr', bench_update_solr),
+]
+
+
+def run(sizes, names, tempdir, write):
+    """
+    Run the benchmarks called `names` at each of `sizes`, writing a line
+    for each with `write`, and return the results as
+    {name: {size: {'seconds': ..., 'jobs_per_second': ...}}}. Sizes are
+    strings, as they are in the JSON baseline.
+
+    """
+    results = {}
+
+    for n in sizes:
+        path = feedgen.write_feed(os.path.join(tempdir, 'feed.xml'), n,
+                                  buid=BUID)
+
+        for name, bench in BENCHMARKS:
+            if name not in names:
+                continue
+
+            seconds = bench(path, BUID)
+            results.setdefault(name, {})[str(n)] = {
+                'seconds': round(seconds, 3),
+                'jobs_per_second': round(n / seconds, 1)}
+            write("%-15s %8s jobs %10.3fs %12.1f jobs/s" % (
+                name, n, seconds, n / seconds))
+
+        os.remove(path)
+
+    return results
+
+
+def check_targets(results, write):
+    """
+    Write how the results compare with TARGETS, and return the
+    (name, size) of each benchmark that misses its target.
+
+    """
+    misses = []
+
+    for name, other, target in TARGETS:
+        for size, result in sorted(results.get(name, {}).items(),
+                                   key=lambda i: int(i[0])):
+            base = results.get(other, {}).get(size)
+
+            if base is None:
+                continue
+
+            ratio = result['jobs_per_second'] / base['jobs_per_second']
+            missed = ratio < target
+            write("%-15s %8s jobs %7.2fx %s (target %sx)%s" % (
+                name, size, ratio, other, target,
+                " MISSED" if missed else ""))
+
+            if missed:
+                misses.append((name, size))
+
+    return misses
+
+
+def compare(results, baseline, tolerance, write):
+    """
+    Write how the results compare with the baseline, and return the
+    (name, size) of each benchmark more than `tolerance` (a fraction)
+    slower than its baseline.
+
+    """
+    regressions = []
+
+    for name, sizes in sorted(results.items()):
+        for size, result in sorted(sizes.items(), key=lambda i: int(i[0])):
+            base = baseline.get(name, {}).get(size)
+
+            if base is None:
+                continue
+
+            ratio = result['jobs_per_second'] / base['jobs_per_second']
+            slower = ratio < 1 - tolerance
+            write("%-15s %8s jobs %7.2fx baseline%s" % (
+                name, size, ratio, " SLOWER" if slower else ""))
+
+            if slower:
+                regressions.append((name, size))
+
+    return regressions
+
+
+class Command(BaseCommand):
+    help = "Benchmark parsing feeds and writing the jobs in them."
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', default=','.join(map(str, SIZES[:2])),
+                    help="Comma-separated numbers of jobs per feed "
+                         "[default: %default]. The full suite is " +
+                         ','.join(map(str, SIZES))),
+        make_option('--only', default=','.join(n for n, b in BENCHMARKS),
+                    help="Comma-separated benchmarks to run "
+                         "[default: %default]"),
+        make_option('--baseline',
+                    help="Baseline file to compare the results with"),
+        make_option('--tolerance', type='float', default=0.25,
+                    help="Fraction slower than the baseline that counts "
+                         "as a regression [default: %default]"),
+        make_option('--save', action='store_true',
+                    help="Save the results in the --baseline file"),
+    )
+
+    def handle(self, *args, **options):
+        if options['save'] and not options['baseline']:
+            raise CommandError("--save needs a --baseline file.")
+
+        sizes = [int(n) for n in options['sizes'].split(',')]
+        write = lambda line: self.stdout.write(line + "\n")
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        tempdir = tempfile.mkdtemp()
+
+        try:
+            BusinessUnitFactory.build(id=BUID).save()
+            results = run(sizes, options['only'].split(','), tempdir, write)
+        finally:
+            shutil.rmtree(tempdir)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        failures = check_targets(results, write)
+        baseline = {'results': {}}
+
+        if options['baseline'] and os.path.exists(options['baseline']):
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+            failures += compare(results, baseline['results'],
+                                options['tolerance'], write)
+
+        if options['save']:
+            for name, sizes in results.items():
+                baseline['results'].setdefault(name, {}).update(sizes)
+
+            baseline['platform'] = platform.platform()
+            baseline['python'] = platform.python_version()
+
+            with open(options['baseline'], 'w') as f:
+                json.dump(baseline, f, indent=2, sort_keys=True)
+
+        if failures:
+            raise CommandError("%s benchmark(s) missed their target or "
+                               "baseline." % len(failures))
@@ -0,0 +1,44 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from jobparse import import_jobs
+
+
+class Command(BaseCommand):
+    args = '<buid buid ...>'
+    help = ("Refresh the jobs of the given Business Units on a pool of "
+            "local worker processes, and print a summary of the run.")
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int',
+                    default=import_jobs.IMPORT_PROCESSES,
+                    help="Number of worker processes. Defaults to the "
+                         "IMPORT_PROCESSES setting, or one per CPU."),
+        make_option('--no-download', action='store_false', dest='download',
+                    default=True,
+                    help="Use the feed files already in DATA_DIR."),
+        make_option('--all', action='store_false', dest='conditional',
+                    default=True,
+                    help="Refresh Business Units whose feed is unchanged "
+                         "too."),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError("Give at least one Business Unit id.")
+
+        try:
+            buids = [int(buid) for buid in args]
+        except ValueError:
+            raise CommandError("Business Unit ids must be integers.")
+
+        summary = import_jobs.refresh_business_units(
+            buids, processes=options['processes'],
+            download=options['download'], conditional=options['conditional'])
+        errors = summary.pop('errors')
+
+        for key in sorted(summary):
+            self.stdout.write("%s: %s\n" % (key, summary[key]))
+
+        for buid in sorted(errors):
+            self.stderr.write("BUID:%s - %s\n" % (buid, "; ".join(errors[buid])))
@@ -3,6 +3,7 @@ from django.db import models
 from slugify import slugify
 
 from moc_coding import models as moc_models
+from jobparse.helpers import slug
 
 class jobListing(models.Model):
     def __unicode__(self):
@@ -15,6 +16,8 @@ class jobListing(models.Model):
     buid = models.ForeignKey('BusinessUnit')
     city = models.CharField(max_length=200, blank=True, null=True)
     citySlug = models.SlugField(blank=True, null=True)
+    # A hash of the feed data for the job; see xmlparse.JobFeed.fingerprint.
+    content_hash = models.CharField(max_length=40, blank=True, null=True)
     country = models.CharField(max_length=200, blank=True, null=True)
     countrySlug = models.SlugField(blank=True, null=True)
     country_short = models.CharField(max_length=3, blank=True, null=True,
@@ -40,10 +43,21 @@ class jobListing(models.Model):
         return self.id
 
     def save(self):
-        self.titleSlug = slugify(self.title)
-        self.countrySlug = slugify(self.country)
-        self.stateSlug = slugify(self.state)
-        self.citySlug = slugify(self.city)
+        self.set_derived_fields()
+        super(jobListing, self).save()
+
+    def set_derived_fields(self):
+        """
+        Fill in the slug fields and `location` from the other fields of
+        the job. `save` does this for every job; code that writes jobs
+        without calling `save` (see `import_jobs.bulk_save_jobs`) must
+        call it itself.
+
+        """
+        self.titleSlug = slug(self.title)
+        self.countrySlug = slug(self.country)
+        self.stateSlug = slug(self.state)
+        self.citySlug = slug(self.city)
         
         if self.city and self.state_short:
             self.location = self.city + ', ' + self.state_short
@@ -55,8 +69,6 @@ class jobListing(models.Model):
             self.location = 'Virtual, ' + self.country_short
         else:
             self.location = 'Global'
-            
-        super(jobListing, self).save()
 
 
 class BusinessUnit(models.Model):
@@ -96,4 +108,10 @@ class BusinessUnit(models.Model):
     associated_jobs = models.IntegerField('Associated Jobs', default=0)
     veteran_commit = models.BooleanField('Veteran Commit', default=True)
     customcareers = generic.GenericRelation(moc_models.CustomCareer)
+    # The validators and content hash of the last feed file imported in
+    # full; see `import_jobs.fetch_feed_file`.
+    feed_etag = models.CharField(max_length=200, null=True, blank=True)
+    feed_last_modified = models.CharField(max_length=50, null=True,
+                                          blank=True)
+    feed_hash = models.CharField(max_length=40, null=True, blank=True)
 
@@ -0,0 +1,515 @@
+"""
+Solr clients shared by everything in a worker process that talks to the
+Solr index.
+
+pysolr keeps an HTTP session, and with it a pool of keep-alive
+connections, for each `Solr` instance. Building a new instance per
+request means paying for a new connection per request too, so code in
+this app gets its clients from `connections` instead.
+
+"""
+import logging
+import os
+import re
+import threading
+import time
+import Queue
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from lxml import etree
+from pysolr import Solr
+from requests.adapters import HTTPAdapter
+
+
+class SolrConnections(object):
+    """
+    Hands out one `Solr` client per URL, and keeps it for the life of
+    the process so that its connections are reused across requests and
+    tasks.
+
+    Inputs:
+    :pool_size: The most connections each client keeps open to Solr.
+    Threads sharing a client (see `import_jobs`) beyond that number
+    wait for a connection to be freed instead of opening a new one.
+    :timeout: Seconds to wait on Solr before a request fails.
+
+    """
+    def __init__(self, pool_size=10, timeout=60):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._pid = None
+
+    def get(self, url=None):
+        """
+        Return the client for `url`, which defaults to the URL of the
+        default Haystack connection.
+
+        """
+        url = url or settings.HAYSTACK_CONNECTIONS['default']['URL']
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # Sockets opened before a fork (e.g. in the Celery parent
+                # process) can't be shared with the child.
+                self._clients = {}
+                self._pid = os.getpid()
+
+            if url not in self._clients:
+                self._clients[url] = self._connect(url)
+
+            return self._clients[url]
+
+    def _connect(self, url):
+        # Solr clients have had a requests `session` from pysolr 3.0 to
+        # 3.2; see setup.py.
+        conn = Solr(url, timeout=self.timeout)
+        adapter = HTTPAdapter(pool_maxsize=self.pool_size)
+        conn.session.mount('http://', adapter)
+        conn.session.mount('https://', adapter)
+        return conn
+
+    def clear(self):
+        """Close every client's connections and forget the clients."""
+        with self._lock:
+            for conn in self._clients.values():
+                conn.session.close()
+
+            self._clients = {}
+
+    def stats(self):
+        """
+        Return the number of HTTP connections the clients in this process
+        have opened and the number of requests they have sent. Far fewer
+        connections than requests means connections are being reused.
+
+        """
+        stats = {'clients': len(self._clients), 'connections': 0,
+                 'requests': 0}
+
+        for conn in self._clients.values():
+            adapters = set(conn.session.adapters.values())
+
+            for adapter in adapters:
+                pools = adapter.poolmanager.pools
+
+                for key in pools.keys():
+                    stats['connections'] += pools[key].num_connections
+                    stats['requests'] += pools[key].num_requests
+
+        return stats
+
+
+class SolrBatcher(object):
+    """
+    Groups documents into batches to be sent to Solr one request each,
+    by size rather than by count: a batch is full once its documents add
+    up to about `target_bytes` (or it holds `max_docs` documents).
+
+    The target adapts to how long Solr takes. Pass the time each request
+    took to `record`; while requests take longer than `target_seconds`
+    the target is halved, and while they take less than half of that it
+    grows by a quarter, staying between `min_bytes` and `max_bytes`.
+
+    """
+    def __init__(self, target_bytes=4 * 1024 * 1024, target_seconds=5.0,
+                 min_bytes=None, max_bytes=None, max_docs=10000):
+        self.target_bytes = target_bytes
+        self.target_seconds = target_seconds
+        self.min_bytes = min_bytes or target_bytes / 16
+        self.max_bytes = max_bytes or target_bytes * 4
+        self.max_docs = max_docs
+        self.docs = []
+        self.size = 0
+        self._lock = threading.Lock()
+
+    def add(self, doc):
+        """
+        Add a document to the current batch. Returns the batch if that
+        filled it, or None.
+
+        """
+        self.docs.append(doc)
+        self.size += doc_size(doc)
+
+        if self.size >= self.target_bytes or len(self.docs) >= self.max_docs:
+            return self.flush()
+
+    def flush(self):
+        """Return the current batch, which may be empty, and start anew."""
+        docs = self.docs
+        self.docs = []
+        self.size = 0
+        return docs
+
+    def record(self, seconds):
+        """Adjust the target size given the time a request took."""
+        with self._lock:
+            if seconds > self.target_seconds:
+                self.target_bytes = max(self.min_bytes,
+                                        self.target_bytes / 2)
+            elif seconds < self.target_seconds / 2:
+                self.target_bytes = min(self.max_bytes,
+                                        self.target_bytes * 5 / 4)
+
+
+def doc_size(doc):
+    """
+    Return roughly how many bytes a Solr document takes up in an update
+    request.
+
+    """
+    size = 0
+
+    for key, value in doc.iteritems():
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+
+        for item in value:
+            if not isinstance(item, basestring):
+                item = str(item)
+            # The value plus its <field name="..."></field> markup.
+            size += len(item) + len(key) + 22
+
+    return size
+
+
+class SolrWriter(object):
+    """
+    Sends add and delete requests to Solr from a pool of threads, so that
+    waiting on one request doesn't hold up the next.
+
+    At most `max_pending` requests are queued at once; past that, `add`
+    and `delete` block until a thread frees a slot, so a fast producer
+    can't pile up documents in memory. Requests of the same kind run
+    concurrently, but a delete is only sent once every earlier add has
+    finished, and vice versa, so that a document is never deleted and
+    re-added (or the other way around) out of order.
+
+    If a request fails, the writer stops sending requests and the
+    exception is raised from the next call to `add`, `delete`, `join` or
+    `close`.
+
+    Inputs:
+    :conn: A `Solr` client. Its connection pool should be at least as
+    large as `threads`.
+    :threads: The number of requests in flight at once.
+    :max_pending: The number of requests that may wait for a thread.
+    :callback: If given, called from the sending thread with the method,
+    number of documents and seconds taken of each request that succeeds.
+
+    """
+    def __init__(self, conn, threads=4, max_pending=4, callback=None):
+        self.conn = conn
+        self.callback = callback
+        # (method, number of documents, seconds) for each request sent.
+        self.latencies = []
+        self.error = None
+        self._closed = False
+        self._method = None
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue(maxsize=max_pending)
+        self._threads = [threading.Thread(target=self._work)
+                         for i in range(threads)]
+
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def add(self, docs, **kwargs):
+        """Queue `conn.add(docs, **kwargs)`."""
+        self._submit('add', len(docs), self.conn.add, (docs,), kwargs)
+
+    def delete(self, size=None, **kwargs):
+        """
+        Queue `conn.delete(**kwargs)`. `size` is the number of documents
+        the request deletes, if known; it is only used in `stats`.
+
+        """
+        self._submit('delete', size, self.conn.delete, (), kwargs)
+
+    def delete_ids(self, ids, **kwargs):
+        """Queue `delete_ids(conn, ids, **kwargs)`."""
+        self._submit('delete', len(ids), delete_ids, (self.conn, ids),
+                     kwargs)
+
+    def _submit(self, method, size, func, args, kwargs):
+        self._raise_error()
+
+        if method != self._method:
+            self.join()
+            self._method = method
+
+        self._queue.put((method, size, func, args, kwargs))
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+
+            try:
+                if item is None:
+                    return
+
+                method, size, func, args, kwargs = item
+
+                if self.error is None:
+                    start = time.time()
+                    func(*args, **kwargs)
+                    elapsed = time.time() - start
+
+                    with self._lock:
+                        self.latencies.append((method, size, elapsed))
+
+                    logging.info("SOLR - %s of %s docs took %.3fs" %
+                                 (method, size, elapsed))
+
+                    if self.callback is not None:
+                        self.callback(method, size, elapsed)
+            except Exception as e:
+                with self._lock:
+                    if self.error is None:
+                        self.error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def join(self):
+        """Wait until every queued request has been sent."""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Wait for the queued requests, then stop the threads."""
+        if not self._closed:
+            self._closed = True
+            self._queue.join()
+
+            for thread in self._threads:
+                self._queue.put(None)
+
+            for thread in self._threads:
+                thread.join()
+
+        self._raise_error()
+
+    def stats(self):
+        """
+        Return the number of requests sent and the mean and longest time
+        they took, for each method.
+
+        """
+        stats = {}
+
+        with self._lock:
+            latencies = list(self.latencies)
+
+        for method in set(l[0] for l in latencies):
+            times = [l[2] for l in latencies if l[0] == method]
+            stats[method] = {'requests': len(times),
+                             'mean': sum(times) / len(times),
+                             'max': max(times)}
+
+        return stats
+
+
+def delete_ids(conn, ids, commit=True):
+    """
+    Delete the documents with the given uniqueKey values in one request.
+    `Solr.delete` only accepts a list of ids from pysolr 3.3 on. Unlike a
+    delete by query, this isn't bound by maxBooleanClauses and needs no
+    query parsing.
+
+    """
+    message = "<delete>%s</delete>" % "".join(
+        "<id>%s</id>" % escape(unicode(id)) for id in ids)
+    return conn._update(message, commit=commit)
+
+
+class MemorySolr(object):
+    """
+    Stands in for a `Solr` client, keeping the index in memory, so that
+    the requests code makes of Solr can be tested and measured without a
+    Solr server.
+
+    Every call is recorded in `calls` as a (method, size, seconds) tuple.
+    The size is roughly the bytes of documents sent (for `add`) or
+    returned (for `search`), or the length of the query or message (for
+    deletes). See `count` and `size`.
+
+    Queries are a whitespace-separated list of clauses that must all
+    match, each one of '*:*', 'field:value', 'field:(value OR value)',
+    'field:[low TO high]' or 'field:{low TO high}' ('*' for an open end),
+    optionally preceded by '-' to exclude the documents it matches.
+
+    Inputs:
+    :int_fields: Fields the Solr schema holds as numbers. Their values
+    are stored, compared and returned as integers.
+    :latency: Seconds each call waits before it is answered, to stand in
+    for the round trip to Solr.
+    :fields: If given, only these fields of each document are kept, as if
+    the others weren't stored, so that large indexes fit in memory.
+
+    """
+    def __init__(self, int_fields=('buid', 'uid'), latency=0, fields=None):
+        self.int_fields = set(int_fields)
+        self.latency = latency
+        self.fields = fields
+        # Documents by uniqueKey ('id').
+        self.docs = {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def search(self, q='*:*', fq=None, fl=None, sort=None, rows=10,
+               start=0, **kwargs):
+        start_time = time.time()
+
+        if isinstance(fq, basestring):
+            fq = [fq]
+
+        with self._lock:
+            docs = [doc for doc in self.docs.itervalues()
+                    if all(self._match(doc, query)
+                           for query in [q] + list(fq or []))]
+
+        for field, order in reversed(self._sort_fields(sort)):
+            docs.sort(key=lambda doc: doc.get(field),
+                      reverse=order == 'desc')
+
+        page = [self._fields(doc, fl)
+                for doc in docs[int(start):int(start) + int(rows)]]
+        self._record('search', sum(doc_size(doc) for doc in page),
+                     start_time)
+        return MemoryResults(page, len(docs))
+
+    def add(self, docs, **kwargs):
+        start_time = time.time()
+
+        with self._lock:
+            for doc in docs:
+                doc = dict((key, self._value(key, value))
+                           for key, value in doc.iteritems()
+                           if self.fields is None or key in self.fields)
+                self.docs[doc['id']] = doc
+
+        self._record('add', sum(doc_size(doc) for doc in docs), start_time)
+
+    def delete(self, id=None, q=None, **kwargs):
+        start_time = time.time()
+        ids = [id] if isinstance(id, basestring) else list(id or [])
+        self._delete(ids, [q] if q else [])
+        self._record('delete', len(q or '') + sum(len(i) for i in ids),
+                     start_time)
+
+    def _update(self, message, **kwargs):
+        # The delete messages built by `delete_ids`. Adds go through `add`.
+        start_time = time.time()
+        node = etree.fromstring(message)
+        self._delete([id.text for id in node.iter('id')],
+                     [query.text for query in node.iter('query')])
+        self._record('delete', len(message), start_time)
+
+    def count(self, method=None):
+        """Return the number of calls made, or of calls to `method`."""
+        return len([c for c in self.calls if method in (None, c[0])])
+
+    def size(self, method=None):
+        """Return the total size of the calls made, or those to `method`."""
+        return sum(c[1] for c in self.calls if method in (None, c[0]))
+
+    def _delete(self, ids, queries):
+        with self._lock:
+            for id in ids:
+                self.docs.pop(id, None)
+
+            for query in queries:
+                for key, doc in self.docs.items():
+                    if self._match(doc, query):
+                        del self.docs[key]
+
+    def _record(self, method, size, start_time):
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.calls.append((method, size, time.time() - start_time))
+
+    def _value(self, field, value):
+        if field in self.int_fields and value is not None:
+            if isinstance(value, (list, tuple)):
+                return [long(v) for v in value]
+            return long(value)
+
+        return value
+
+    def _match(self, doc, query):
+        for negate, field, term in _QUERY_CLAUSE.findall(query):
+            matched = field == '*' or self._match_field(doc, field, term)
+
+            if matched == bool(negate):
+                return False
+
+        return True
+
+    def _match_field(self, doc, field, term):
+        values = doc.get(field)
+
+        if not isinstance(values, (list, tuple)):
+            values = [] if values is None else [values]
+
+        if term[0] in '[{':
+            low, high = term[1:-1].split(' TO ')
+            low = None if low == '*' else self._value(field, low)
+            high = None if high == '*' else self._value(field, high)
+            inclusive = term[0] == '['
+            return any((low is None or v > low or (inclusive and v == low))
+                       and (high is None or v < high or
+                            (inclusive and v == high)) for v in values)
+
+        if term[0] == '(':
+            terms = term[1:-1].split(' OR ')
+        else:
+            terms = [term]
+
+        terms = set(self._value(field, t.strip('"')) for t in terms)
+        return any(v in terms for v in values)
+
+    def _sort_fields(self, sort):
+        return [tuple(part.split()) for part in (sort or '').split(',')
+                if part.strip()]
+
+    def _fields(self, doc, fl):
+        if not fl or fl == '*':
+            return dict(doc)
+
+        fields = [f for f in fl.replace(',', ' ').split() if f != 'score']
+        return dict((f, doc[f]) for f in fields if f in doc)
+
+
+class MemoryResults(object):
+    """The parts of `pysolr.Results` that `MemorySolr.search` fills in."""
+    def __init__(self, docs, hits):
+        self.docs = docs
+        self.hits = hits
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+# A clause of a `MemorySolr` query: an optional '-', then a field name (or
+# '*') and a term, which may be a bracketed range or a parenthesised list.
+_QUERY_CLAUSE = re.compile(r'(-?)([\w*]+):(\[[^\]]*\]|\{[^}]*\}|'
+                           r'\([^)]*\)|"[^"]*"|\S+)')
+
+
+connections = SolrConnections(
+    pool_size=getattr(settings, 'SOLR_POOL_SIZE', 10),
+    timeout=getattr(settings, 'SOLR_TIMEOUT', 60)
+)
@@ -1,16 +1,187 @@
 import os
 import sys
+import logging
+import time
+from collections import OrderedDict
 
-from celery.task import task
+from celery.task import chord, task
 
+from django.conf import settings
+
+import coalesce
 import import_jobs
 
+# Seconds to wait before trying again to refresh a Business Unit that was
+# notified while another refresh held its lock.
+NOTIFICATION_RETRY_DELAY = getattr(settings, 'NOTIFICATION_RETRY_DELAY', 60)
+# Seconds after which a queued or running refresh is forgotten by the
+# coalescers below, in case it died without finishing.
+NOTIFICATION_TIMEOUT = getattr(settings, 'NOTIFICATION_TIMEOUT', 2 * 3600)
+# Coalesces the SNS notifications handled by `notify_refresh`.
+notifications = coalesce.Coalescer(coalesce.get_store(),
+                                   timeout=NOTIFICATION_TIMEOUT)
+# Coalesces the resets asked for by `reset_business_unit`.
+resets = coalesce.Coalescer(coalesce.get_store(),
+                            timeout=NOTIFICATION_TIMEOUT,
+                            prefix='jobparse.reset')
+
+@task(name="tasks.task_refresh_business_unit")
+def task_refresh_business_unit(jsid, **kwargs):
+    """
+    Download and parse the feed file for a Business Unit once, then write
+    the jobs to both the RDBMS and the Solr index. Returns None without
+    doing anything if the Business Unit is already being refreshed.
+
+    A retry of the task reuses the feed file downloaded by an earlier
+    attempt (see `import_jobs.store_feed_file`).
+
+    """
+    kwargs.setdefault('reuse_key', task_refresh_business_unit.request.id)
+
+    with import_jobs.business_unit_lock(jsid) as locked:
+        if locked:
+            return import_jobs.refresh_business_unit(jsid, **kwargs)
+
+@task(name="tasks.task_refresh_business_units")
+def task_refresh_business_units(jsids, **kwargs):
+    """
+    Queue a `task_try_refresh_business_unit` for each of a list of
+    Business Units, and a `task_summarize_refreshes` to run once they have
+    all finished. Keyword arguments are passed to
+    `import_jobs.refresh_business_unit`.
+
+    Returns:
+    The id of the summary task, whose result is the summary of the run
+    (see `import_jobs.refresh_business_units`).
+
+    """
+    header = [task_try_refresh_business_unit.subtask((jsid,), kwargs)
+              for jsid in OrderedDict.fromkeys(jsids)]
+    callback = task_summarize_refreshes.subtask((time.time(),))
+
+    # A chord with no tasks in it never runs its callback.
+    if not header:
+        return callback.delay([]).task_id
+
+    return chord(header)(callback).task_id
+
+@task(name="tasks.task_try_refresh_business_unit")
+def task_try_refresh_business_unit(jsid, **kwargs):
+    """
+    Refresh one Business Unit of a `task_refresh_business_units` batch,
+    unless it is locked. See `import_jobs.try_refresh_business_unit`.
+
+    """
+    kwargs.setdefault('reuse_key',
+                      task_try_refresh_business_unit.request.id)
+    return import_jobs.try_refresh_business_unit(jsid, **kwargs)
+
+@task(name="tasks.task_summarize_refreshes")
+def task_summarize_refreshes(results, start):
+    """
+    Add up the results of a `task_refresh_business_units` batch, which
+    was queued at the time `start`.
+
+    """
+    summary = import_jobs.summarize_refreshes(results)
+    summary['seconds'] = time.time() - start
+    logging.info("Batch refresh complete for %s buids" % len(results),
+                 extra={"data": summary})
+    return summary
+
+@task(name="tasks.task_refresh_notified")
+def task_refresh_notified(jsid):
+    """
+    Refresh a Business Unit in response to notifications that its feed is
+    ready. Queued by `notify_refresh`; see `_refresh_coalesced`.
+
+    """
+    return _refresh_coalesced(task_refresh_notified, notifications, jsid)
+
+def notify_refresh(jsid):
+    """
+    Queue a refresh of a Business Unit whose feed is ready, unless one is
+    already queued or running, in which case the notification is folded
+    into it (see `coalesce`). Returns True if a refresh was queued.
+
+    """
+    return _queue_coalesced(task_refresh_notified, notifications, jsid)
+
+@task(name="tasks.task_reset_business_unit")
+def task_reset_business_unit(jsid):
+    """
+    Download and parse the feed file for a Business Unit, and write every
+    job in it again, even if neither the feed nor the job has changed.
+    Queued by `reset_business_unit`; see `_refresh_coalesced`.
+
+    """
+    return _refresh_coalesced(task_reset_business_unit, resets, jsid,
+                              update_all=True, force=True,
+                              conditional=False, skip_unchanged=False)
+
+def reset_business_unit(jsid):
+    """
+    Queue a `task_reset_business_unit` for a Business Unit, unless one is
+    already queued, or one is running, in which case another is queued
+    once it finishes. Returns True if a reset was queued.
+
+    """
+    return _queue_coalesced(task_reset_business_unit, resets, jsid)
+
+def _refresh_coalesced(refresh_task, coalescer, jsid, **kwargs):
+    """
+    Refresh a Business Unit for a task queued through `coalescer`, then
+    queue one more refresh if any were asked for meanwhile. If the
+    Business Unit is locked by another refresh, one is queued to run
+    after NOTIFICATION_RETRY_DELAY seconds instead. Keyword arguments are
+    passed to `import_jobs.refresh_business_unit`.
+
+    """
+    coalescer.start(jsid)
+    locked = False
+
+    try:
+        with import_jobs.business_unit_lock(jsid) as locked:
+            if locked:
+                return import_jobs.refresh_business_unit(
+                    jsid, reuse_key=refresh_task.request.id, **kwargs)
+    finally:
+        if not locked:
+            # Another refresh holds the lock, and may have fetched the
+            # feed before it was republished. Try again once it is
+            # likely to have finished.
+            coalescer.defer(jsid)
+
+        if coalescer.finish(jsid):
+            refresh_task.apply_async(
+                (jsid,), countdown=0 if locked else NOTIFICATION_RETRY_DELAY)
+
+def _queue_coalesced(refresh_task, coalescer, jsid):
+    """
+    Queue `refresh_task` for a Business Unit, unless `coalescer` says one
+    is already queued or running. Returns True if it was queued.
+
+    """
+    if not coalescer.notify(jsid):
+        return False
+
+    try:
+        refresh_task.delay(jsid)
+    except:
+        # Nothing was queued, so don't hold off later requests.
+        coalescer.finish(jsid)
+        raise
+
+    return True
+
 @task(name="tasks.task_refresh_bunit_jobs")
 def task_refresh_bunit_jobs(jsid, **kwargs):
+    kwargs.setdefault('reuse_key', task_refresh_bunit_jobs.request.id)
     import_jobs.refresh_bunit_jobs(jsid, **kwargs)
 
 @task(name="tasks.task_update_solr")
 def task_update_solr(jsid, **kwargs):
+    kwargs.setdefault('reuse_key', task_update_solr.request.id)
     import_jobs.update_solr(jsid, **kwargs)
 
 @task(name="tasks.task_clear_solr")
@@ -1,2 +1,8 @@
+from coalesce import *
+from download import *
+from feedstore import *
+from helpers import *
 from import_jobs import *
+from instrument import *
+from solrconn import *
 from xmlparse import *
@@ -0,0 +1,69 @@
+from django.test import TestCase
+
+from jobparse import coalesce
+
+
+class CoalescerTestCase(TestCase):
+    def setUp(self):
+        super(CoalescerTestCase, self).setUp()
+        self.coalescer = coalesce.Coalescer(coalesce.MemoryStore())
+
+    def test_notify(self):
+        """
+        Test that notifications while a refresh is queued are folded into
+        it, and that any number while it runs give one follow-up.
+
+        """
+        self.assertTrue(self.coalescer.notify(1))
+        self.assertFalse(self.coalescer.notify(1))
+        # A different Business Unit isn't held up.
+        self.assertTrue(self.coalescer.notify(2))
+
+        self.coalescer.start(1)
+        self.assertFalse(self.coalescer.finish(1))
+
+        self.assertTrue(self.coalescer.notify(1))
+        self.coalescer.start(1)
+        self.assertFalse(self.coalescer.notify(1))
+        self.assertFalse(self.coalescer.notify(1))
+        self.assertTrue(self.coalescer.finish(1))
+        # The follow-up is now queued.
+        self.assertFalse(self.coalescer.notify(1))
+        self.coalescer.start(1)
+        self.assertFalse(self.coalescer.finish(1))
+        self.assertTrue(self.coalescer.notify(1))
+
+    def test_defer(self):
+        """
+        Test that a refresh that couldn't run asks for another, however
+        few notifications arrived meanwhile.
+
+        """
+        self.assertTrue(self.coalescer.notify(1))
+        self.coalescer.start(1)
+        self.coalescer.defer(1)
+        self.assertTrue(self.coalescer.finish(1))
+        self.coalescer.start(1)
+        self.assertFalse(self.coalescer.finish(1))
+
+    def test_prefix(self):
+        """
+        Test that coalescers with different prefixes don't share state,
+        even in the same store.
+
+        """
+        resets = coalesce.Coalescer(self.coalescer.store,
+                                    prefix='jobparse.reset')
+        self.assertTrue(self.coalescer.notify(1))
+        self.assertTrue(resets.notify(1))
+        self.assertFalse(resets.notify(1))
+
+    def test_timeout(self):
+        """
+        Test that a refresh that never finished stops holding off
+        notifications once its state expires.
+
+        """
+        coalescer = coalesce.Coalescer(coalesce.MemoryStore(), timeout=-1)
+        self.assertTrue(coalescer.notify(1))
+        self.assertTrue(coalescer.notify(1))
@@ -0,0 +1,141 @@
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from StringIO import StringIO
+
+from django.test import TestCase
+
+from jobparse import download
+
+FEED = "<source>%s</source>" % ("<job><title>Engineer</title></job>" * 1000)
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """
+    Serves FEED gzipped, with an ETag, and answers 304 to requests that
+    already have it.
+
+    """
+    etag = '"feed-1"'
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = StringIO()
+        with gzip.GzipFile(fileobj=body, mode='wb') as f:
+            f.write(FEED)
+        body = body.getvalue()
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadTestCase(TestCase):
+    def setUp(self):
+        super(DownloadTestCase, self).setUp()
+        self.server = HTTPServer(('127.0.0.1', 0), FeedHandler)
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = "http://127.0.0.1:%s/" % self.server.server_port
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'feed.xml')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tempdir)
+        super(DownloadTestCase, self).tearDown()
+
+    def test_fetch(self):
+        """
+        Test that a gzipped feed is saved decompressed, along with its
+        validators and content hash.
+
+        """
+        feed = download.fetch(self.url, self.path)
+        self.assertTrue(feed.changed)
+        self.assertEqual(feed.etag, FeedHandler.etag)
+        self.assertEqual(open(self.path).read(), FEED)
+        self.assertEqual(self.server.requests[0]['accept-encoding'], 'gzip')
+        self.assertEqual(os.listdir(self.tempdir), ['feed.xml'])
+
+    def test_fetch_not_modified(self):
+        """
+        Test that a feed is reported unchanged when the server answers 304,
+        or when it sends the same content again.
+
+        """
+        feed = download.fetch(self.url, self.path)
+        os.remove(self.path)
+        unchanged = download.fetch(self.url, self.path, etag=feed.etag,
+                                   content_hash=feed.content_hash)
+        self.assertFalse(unchanged.changed)
+        self.assertIsNone(unchanged.path)
+        self.assertFalse(os.path.exists(self.path))
+
+        unchanged = download.fetch(self.url, self.path,
+                                   content_hash=feed.content_hash)
+        self.assertFalse(unchanged.changed)
+        self.assertEqual(unchanged.etag, FeedHandler.etag)
+
+
+class ChunkedSource(object):
+    """A file-like object returning `chunks` one read at a time."""
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.closed = False
+
+    def read(self, size=-1):
+        item = self.chunks.pop(0) if self.chunks else ''
+
+        if isinstance(item, Exception):
+            raise item
+
+        return item
+
+    def close(self):
+        self.closed = True
+
+
+class PrefetchReaderTestCase(TestCase):
+    def test_read(self):
+        """
+        Test that everything in the source is read, whatever the read
+        sizes, and copied to `copy_path` if given.
+
+        """
+        tempdir = tempfile.mkdtemp()
+        copy_path = os.path.join(tempdir, 'copy.xml')
+        chunks = ['<source>', '<job/>' * 100, '</source>']
+        reader = download.PrefetchReader(ChunkedSource(chunks), max_chunks=1,
+                                         copy_path=copy_path)
+        data = reader.read(5)
+        data += ''.join(iter(lambda: reader.read(7), ''))
+        reader.close()
+        self.assertEqual(data, ''.join(chunks))
+        self.assertEqual(open(copy_path).read(), data)
+        self.assertTrue(reader.source.closed)
+        shutil.rmtree(tempdir)
+
+    def test_error_raised(self):
+        """Test that an error reading the source is raised from `read`."""
+        reader = download.PrefetchReader(ChunkedSource(['<source>',
+                                                        IOError('reset')]))
+        self.assertRaises(IOError, reader.read)
+        reader.close()
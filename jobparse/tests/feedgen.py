@@ -0,0 +1,164 @@
+"""
+Writes synthetic DEv2 feed files of any size, for tests and benchmarks.
+
+The feeds have the structure `xmlparse.DEv2JobFeed` reads, with field
+values drawn the way they are spread in real feeds: a few cities and
+ONET codes account for most jobs, some jobs have no ONET code, and
+description lengths vary from a couple of sentences to several pages.
+The same arguments always give the same feed.
+
+    >> write_feed('/tmp/feed.xml', 10000, buid=5)
+
+"""
+import datetime
+import random
+from xml.sax.saxutils import escape
+
+CITIES = [
+    ('Indianapolis', 'Indiana', 'IN', '46201'),
+    ('New York', 'New York', 'NY', '10095'),
+    ('Chicago', 'Illinois', 'IL', '60601'),
+    ('Los Angeles', 'California', 'CA', '90212'),
+    ('Atlanta', 'Georgia', 'GA', '30309'),
+    ('Charlotte', 'North Carolina', 'NC', '28243'),
+    ('Houston', 'Texas', 'TX', '77002'),
+    ('Phoenix', 'Arizona', 'AZ', '85001'),
+    ('Seattle', 'Washington', 'WA', '98101'),
+    ('Denver', 'Colorado', 'CO', '80202'),
+    ('Boston', 'Massachusetts', 'MA', '02108'),
+    ('Miami', 'Florida', 'FL', '33101'),
+    ('Columbus', 'Ohio', 'OH', '43004'),
+    ('Nashville', 'Tennessee', 'TN', '37201'),
+    ('Portland', 'Oregon', 'OR', '97201'),
+    ('St. Louis', 'Missouri', 'MO', '63101'),
+    ('Salt Lake City', 'Utah', 'UT', '84101'),
+    ('Omaha', 'Nebraska', 'NE', '68102'),
+    ('Richmond', 'Virginia', 'VA', '23218'),
+    ('Fort Wayne', 'Indiana', 'IN', '46802'),
+]
+
+ONET_CODES = [
+    '11-1011.00', '11-3031.01', '13-2011.01', '15-1132.00', '15-1151.00',
+    '29-1141.00', '29-2061.00', '31-1014.00', '33-3051.01', '35-2014.00',
+    '41-2031.00', '41-3031.01', '43-4051.00', '43-6014.00', '47-2111.00',
+    '49-3023.01', '51-4121.06', '53-3032.00', '53-7062.00', '55-1012.00',
+]
+
+TITLES = ['Registered Nurse', 'Software Engineer', 'Sales Associate',
+          'Customer Service Representative', 'Truck Driver',
+          'Financial Analyst', 'Maintenance Technician', 'Store Manager',
+          'Administrative Assistant', 'Welder', 'Pharmacy Technician',
+          'Security Officer', 'Line Cook', 'Electrician', 'Accountant']
+
+LEVELS = ['', '', '', 'Senior ', 'Junior ', 'Lead ', 'Part-Time ']
+
+WORDS = ("the a and of to in for with our you your we will be is are as "
+         "on at by or this team work job role position candidate "
+         "candidates experience years required preferred skills ability "
+         "customer customers service support sales manage management "
+         "develop development maintain ensure provide responsible duties "
+         "including other related knowledge strong excellent communication "
+         "written verbal environment fast paced company benefits health "
+         "dental vision insurance paid time off retirement plan equal "
+         "opportunity employer qualified applicants receive consideration "
+         "without regard race color religion sex national origin "
+         "disability veteran status high school diploma degree bachelor "
+         "license certification must able lift pounds travel schedule "
+         "shifts weekends nights overtime full part hourly salary "
+         "competitive training safety quality standards procedures "
+         "policies records reports data systems software computer "
+         "equipment tools vehicle patients care store products "
+         "inventory orders accounts financial analysis projects "
+         "operations department supervisor staff employees").split()
+
+DATETIME_BASE = datetime.datetime(2012, 5, 1)
+
+
+def _weighted(seq):
+    """
+    Repeat the items of `seq` so that picking uniformly from the result
+    picks the n-th item about 1/n as often as the first.
+
+    """
+    weighted = []
+
+    for i, item in enumerate(seq):
+        weighted.extend([item] * (len(seq) // (i + 1)))
+
+    return weighted
+
+
+def _datetime(dt):
+    hour = dt.hour % 12 or 12
+    return "%s/%s/%s %s:%02d:%02d %s" % (dt.month, dt.day, dt.year, hour,
+                                         dt.minute, dt.second,
+                                         'AM' if dt.hour < 12 else 'PM')
+
+
+def _description(rnd, text):
+    # Mostly a paragraph or two, with a long tail of very long ones. Each
+    # is a slice of `text`, which is quicker than picking every word.
+    words = min(int(rnd.lognormvariate(4.5, 0.9)), 5000) + 10
+    start = rnd.randint(0, len(text) - words)
+    return ' '.join(text[start:start + words]).capitalize()
+
+
+def iter_jobs(n, seed=0, first_uid=1000):
+    """
+    Yield the fields of `n` jobs, each as a list of (tag, text) pairs in
+    the order they appear in the feed.
+
+    """
+    rnd = random.Random(seed)
+    text = [rnd.choice(WORDS) for i in xrange(20000)]
+    cities = _weighted(CITIES)
+    onets = _weighted(ONET_CODES)
+    titles = _weighted(TITLES)
+
+    for i in xrange(n):
+        city, state, state_short, zipcode = rnd.choice(cities)
+        created = DATETIME_BASE + datetime.timedelta(
+            seconds=rnd.randint(0, 30 * 24 * 3600))
+        modified = created + datetime.timedelta(
+            seconds=rnd.randint(0, 7 * 24 * 3600))
+        yield [
+            ('city', city),
+            ('country', 'United States'),
+            ('country_short', 'USA'),
+            ('state', state),
+            ('state_short', state_short),
+            ('title', rnd.choice(LEVELS) + rnd.choice(titles)),
+            ('uid', str(first_uid + i)),
+            ('reqid', 'REQ%07d' % rnd.randint(0, 9999999)),
+            ('link', 'http://jobs.example.com/%s' % (first_uid + i)),
+            ('description', _description(rnd, text)),
+            ('hitkey', 'GEN%06d' % rnd.randint(0, 999999)),
+            ('zip', zipcode),
+            ('onet_code', rnd.choice(onets) if rnd.random() > 0.1 else ''),
+            ('date_created', _datetime(created)),
+            ('date_modified', _datetime(modified)),
+        ]
+
+
+def write_feed(path, n, buid=0, company='Example Company', seed=0):
+    """
+    Write a feed file of `n` jobs for the Business Unit `buid` to `path`.
+    Jobs are written as they are generated, so feeds of any size can be
+    written in constant memory.
+
+    """
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?><feed><meta>'
+                '<job_source_name>%s</job_source_name>'
+                '<job_source_id>%s</job_source_id>'
+                '<date_modified>%s</date_modified></meta><jobs>' %
+                (escape(company), buid, _datetime(DATETIME_BASE)))
+
+        for job in iter_jobs(n, seed=seed):
+            f.write('<job>%s</job>' % ''.join(
+                '<%s>%s</%s>' % (tag, escape(text), tag)
+                for tag, text in job))
+
+        f.write('</jobs></feed>')
+
+    return path
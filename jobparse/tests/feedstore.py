@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.test import TestCase
+
+from jobparse.feedstore import FeedStore, file_hash
+
+
+class FeedStoreTestCase(TestCase):
+    def setUp(self):
+        super(FeedStoreTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.store = FeedStore(os.path.join(self.tempdir, 'feeds'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        super(FeedStoreTestCase, self).tearDown()
+
+    def _add(self, buid, content, age=0, **info):
+        path = self.store.partial_path(buid)
+
+        with open(path, 'w') as f:
+            f.write(content)
+
+        path = self.store.add(buid, path, **info)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_add(self):
+        """
+        Test that a feed file is stored under its content hash, with what
+        was passed alongside it, and that the latest one is found, or the
+        latest stored with a given reuse key.
+
+        """
+        old = self._add(1, '<source/>', age=60)
+        path = self._add(1, '<source></source>', etag='"1"')
+        self.assertEqual(os.path.basename(path),
+                         file_hash(path) + '.xml')
+        self.assertEqual(self.store.info(path),
+                         {'content_hash': file_hash(path), 'etag': '"1"'})
+        self.assertEqual(self.store.latest(1), path)
+        self.assertIsNone(self.store.latest(2))
+        self.assertTrue(self.store.contains(old))
+        self.assertFalse(self.store.contains(self.tempdir))
+
+        keyed = self._add(1, '<source />', age=45, reuse_key='task-1')
+        self.assertEqual(self.store.latest(1), path)
+        self.assertEqual(self.store.latest(1, reuse_key='task-1'), keyed)
+        self.assertIsNone(self.store.latest(1, reuse_key='task-2'))
+
+        os.utime(path, (time.time() - 60, time.time() - 60))
+        self.assertIsNone(self.store.latest(1, max_age=30))
+
+    def test_evict(self):
+        """
+        Test that expired feed files are evicted, then the oldest ones
+        while the store is over budget, but never one that is leased.
+
+        """
+        expired = self._add(1, 'a' * 10, age=7200)
+        leased = self._add(1, 'b' * 60, age=30)
+        oldest = self._add(2, 'c' * 30, age=20)
+        newest = self._add(2, 'd' * 30)
+        self.store.max_bytes = 100
+        self.store.ttl = 3600
+
+        with self.store.lease(leased):
+            self.store.evict()
+            self.assertFalse(os.path.exists(expired))
+            self.assertTrue(os.path.exists(leased))
+            self.assertFalse(os.path.exists(oldest))
+            self.assertTrue(os.path.exists(newest))
+
+        self.store.max_bytes = 50
+        self.store.evict()
+        self.assertFalse(os.path.exists(leased))
+        self.assertTrue(os.path.exists(newest))
+        self.assertEqual(os.listdir(os.path.join(self.store.root, '1')), [])
@@ -0,0 +1,36 @@
+from django.test import TestCase
+
+from jobparse.helpers import LRUCache, chunked
+
+
+class HelpersTestCase(TestCase):
+    def test_chunked(self):
+        self.assertEqual(list(chunked(4, xrange(10))),
+                         [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+        self.assertEqual(list(chunked(4, [])), [])
+
+    def test_lru_cache(self):
+        """
+        Test that the least recently used result is the one dropped when
+        the cache is full, and that hits and misses are counted.
+
+        """
+        calls = []
+
+        def upper(value):
+            calls.append(value)
+            return value.upper()
+
+        cache = LRUCache(upper, maxsize=2)
+        self.assertEqual(cache('a'), 'A')
+        self.assertEqual(cache('b'), 'B')
+        self.assertEqual(cache('a'), 'A')
+        # 'b' is now the least recently used result, so it is dropped.
+        self.assertEqual(cache('c'), 'C')
+        self.assertEqual(cache('a'), 'A')
+        self.assertEqual(cache('b'), 'B')
+        self.assertEqual(calls, ['a', 'b', 'c', 'b'])
+
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 4))
+        self.assertEqual(stats['size'], 2)
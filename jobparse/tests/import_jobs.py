@@ -3,10 +3,14 @@ import os
 
 from django.conf import settings
 from django.test import TestCase
+from django.test.utils import override_settings
 
-from jobparse import import_jobs
-from ..models import BusinessUnit
+from jobparse import import_jobs, xmlparse
+from jobparse.solrconn import MemorySolr
+from ..models import BusinessUnit, jobListing
+from . import feedgen
 from .factories import BusinessUnitFactory
+from .instrument import records
 
 
 class ImportJobsTestCase(TestCase):
@@ -33,10 +37,201 @@ class ImportJobsTestCase(TestCase):
 
         """
         import_jobs.download_feed_file(self.buid_id)
-        import_jobs.parse_feed_file(self.filepath, self.buid_id)
+        results = import_jobs.parse_feed_file(self.filepath, self.buid_id)
         self.assertFalse(os.access(self.filepath, os.F_OK))
+        self.assertEqual(set(long(job.uid) for job in results['jobs_to_save']),
+                         results['new_jobs_ids'])
+        self.assertFalse(jobListing.objects.filter(buid=self.buid_id).exists())
         import_jobs.download_feed_file(self.buid_id)
 
+    def test_refresh_business_unit(self):
+        """
+        Test that a single pipeline run writes the jobs in the feed file to
+        both the database and Solr, reports the results for each, and
+        deletes the feed file.
+
+        """
+        results = import_jobs.refresh_business_unit(self.buid_id)
+        dbjobs = jobListing.objects.filter(buid=self.buid_id).count()
+        self.assertEqual(results['database']['saved'], dbjobs)
+        self.assertEqual(results['solr']['added'], dbjobs)
+        self.assertIsNone(results['database']['error'])
+        self.assertIsNone(results['solr']['error'])
+        self.assertFalse(os.access(self.filepath, os.F_OK))
+
+    def test_refresh_business_unit_unchanged(self):
+        """
+        Test that running the pipeline again over the same feed skips every
+        job instead of writing it again.
+
+        """
+        import_jobs.refresh_business_unit(self.buid_id)
+        dbjobs = jobListing.objects.filter(buid=self.buid_id).count()
+        # Without 'conditional=False', the unchanged feed file wouldn't be
+        # parsed at all; see test_refresh_business_unit_unchanged_feed.
+        results = import_jobs.refresh_business_unit(self.buid_id,
+                                                    conditional=False)
+        self.assertEqual(results['database']['saved'], 0)
+        self.assertEqual(results['database']['skipped'], dbjobs)
+        self.assertEqual(results['database']['deleted'], 0)
+        self.assertEqual(results['solr']['added'], 0)
+        self.assertEqual(results['solr']['skipped'], dbjobs)
+
+    def test_refresh_business_unit_unchanged_feed(self):
+        """
+        Test that once a feed file has been imported, the pipeline does
+        nothing until the feed changes.
+
+        """
+        results = import_jobs.refresh_business_unit(self.buid_id)
+        self.assertFalse(results['unchanged'])
+        bu = BusinessUnit.objects.get(id=self.buid_id)
+        self.assertTrue(bu.feed_hash)
+        results = import_jobs.refresh_business_unit(self.buid_id)
+        self.assertTrue(results['unchanged'])
+        self.assertIsNone(results['database'])
+        self.assertFalse(os.access(self.filepath, os.F_OK))
+
+    def test_refresh_business_unit_direct(self):
+        """
+        Test that parsing the feed as it downloads writes the same jobs as
+        parsing a downloaded copy, and leaves no feed file behind unless
+        asked to keep one.
+
+        """
+        results = import_jobs.refresh_business_unit(self.buid_id,
+                                                    direct=True)
+        dbjobs = jobListing.objects.filter(buid=self.buid_id).count()
+        self.assertEqual(results['database']['saved'], dbjobs)
+        self.assertEqual(results['solr']['added'], dbjobs)
+        self.assertFalse(os.access(self.filepath, os.F_OK))
+
+        import_jobs.refresh_business_unit(self.buid_id, direct=True,
+                                          conditional=False, keep_copy=True)
+        self.assertTrue(os.access(self.filepath, os.F_OK))
+        os.remove(self.filepath)
+
+    @override_settings(IMPORT_STATS_HOOKS=[
+        'jobparse.tests.instrument.record_hook'])
+    def test_refresh_business_unit_stats(self):
+        """
+        Test that a pipeline run emits a record of the time spent in each
+        stage and the work done.
+
+        """
+        del records[:]
+        import_jobs.refresh_business_unit(self.buid_id)
+        dbjobs = jobListing.objects.filter(buid=self.buid_id).count()
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual(record['buid'], self.buid_id)
+        self.assertEqual(record['counts']['jobs'], dbjobs)
+        self.assertTrue(record['counts']['bytes'] > 0)
+        self.assertTrue(record['counts']['db_queries'] > 0)
+        self.assertTrue(record['counts']['solr_requests'] > 0)
+
+        for stage in ['download', 'open', 'parse', 'moc', 'db_diff',
+                      'db_build', 'db_write', 'solr_diff', 'solr_build',
+                      'solr_write']:
+            self.assertTrue(stage in record['stages'], stage)
+
+    def test_refresh_business_unit_request_budget(self):
+        """
+        Test that importing an unchanged 10,000 job feed again sends no
+        documents to Solr, and only pages through the ones already there.
+
+        """
+        solr = MemorySolr()
+        old = import_jobs.set_solr_backend(solr)
+
+        try:
+            feedgen.write_feed(self.filepath, 10000, buid=self.buid_id)
+            results = import_jobs.refresh_business_unit(self.buid_id,
+                                                        download=False)
+            self.assertEqual(results['solr']['added'], 10000)
+            self.assertEqual(len(solr.docs), 10000)
+            del solr.calls[:]
+
+            feedgen.write_feed(self.filepath, 10000, buid=self.buid_id)
+            results = import_jobs.refresh_business_unit(self.buid_id,
+                                                        download=False)
+        finally:
+            import_jobs.set_solr_backend(old)
+
+        pages = -(-10000 // import_jobs.SOLR_UID_PAGE_SIZE)
+        self.assertEqual(results['solr']['skipped'], 10000)
+        self.assertEqual(solr.count('add'), 0)
+        self.assertEqual(solr.count('delete'), 0)
+        self.assertTrue(solr.count('search') <= pages + 1)
+
+    def test_refresh_business_units(self):
+        """
+        Test that a batch refresh refreshes each Business Unit once,
+        skips one that is locked, and sums up the results.
+
+        """
+        summary = import_jobs.refresh_business_units(
+            [self.buid_id, self.buid_id], processes=1)
+        dbjobs = jobListing.objects.filter(buid=self.buid_id).count()
+        self.assertEqual(summary['refreshed'], 1)
+        self.assertEqual(summary['saved'], dbjobs)
+        self.assertEqual(summary['added'], dbjobs)
+        self.assertEqual(summary['errors'], {})
+
+        with import_jobs.business_unit_lock(self.buid_id) as locked:
+            self.assertTrue(locked)
+            summary = import_jobs.refresh_business_units([self.buid_id],
+                                                         processes=1)
+            self.assertEqual(summary['skipped'], 1)
+            self.assertEqual(summary['refreshed'], 0)
+
+    def test_bulk_save_jobs(self):
+        """
+        Test that bulk_save_jobs inserts new jobs and updates existing ones
+        in place, filling in the fields jobListing.save would.
+
+        """
+        import_jobs.download_feed_file(self.buid_id)
+        jobfeed = xmlparse.DEv2JobFeed(self.filepath)
+        jobs = jobfeed.joblist()
+        self.assertEqual(len(import_jobs.bulk_save_jobs(jobs)), len(jobs))
+        dbjobs = jobListing.objects.filter(buid=self.buid_id)
+        ids = dict(dbjobs.values_list('uid', 'id'))
+        self.assertEqual(len(ids), len(jobs))
+
+        jobs = jobfeed.joblist()
+        self.assertEqual(len(import_jobs.bulk_save_jobs(jobs)), len(jobs))
+        self.assertEqual(dict(dbjobs.values_list('uid', 'id')), ids)
+
+        for job in dbjobs:
+            derived = (job.titleSlug, job.citySlug, job.location)
+            job.set_derived_fields()
+            self.assertEqual(derived, (job.titleSlug, job.citySlug,
+                                       job.location))
+        os.remove(self.filepath)
+
+    def test_delete_jobs(self):
+        """
+        Test that delete_jobs removes the given jobs in batches and
+        reports how many it deleted, and that clear_jobs removes the rest
+        and makes the next refresh import the feed again.
+
+        """
+        import_jobs.refresh_business_unit(self.buid_id)
+        dbjobs = jobListing.objects.filter(buid=self.buid_id)
+        uids = list(dbjobs.values_list('uid', flat=True))
+        half = uids[:len(uids) / 2]
+        self.assertEqual(import_jobs.delete_jobs(half, batch_size=3),
+                         (len(half), []))
+        self.assertEqual(dbjobs.count(), len(uids) - len(half))
+        import_jobs.clear_jobs(self.buid_id)
+        self.assertEqual(dbjobs.count(), 0)
+        # The next refresh imports the feed again, though it is unchanged.
+        self.assertIsNone(BusinessUnit.objects.get(id=self.buid_id).feed_hash)
+        results = import_jobs.refresh_business_unit(self.buid_id)
+        self.assertFalse(results['unchanged'])
+        self.assertEqual(dbjobs.count(), len(uids))
+
     def test_set_bu_title(self):
         """
         Ensure that if a feedfile for a BusinessUnit comes through, and
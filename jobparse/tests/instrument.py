@@ -0,0 +1,55 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from jobparse import instrument
+from ..models import BusinessUnit
+
+# The records passed to `record_hook`.
+records = []
+
+
+def record_hook(record):
+    records.append(record)
+
+
+def failing_hook(record):
+    raise ValueError(record)
+
+
+class ImportStatsTestCase(TestCase):
+    def setUp(self):
+        super(ImportStatsTestCase, self).setUp()
+        del records[:]
+
+    @override_settings(IMPORT_STATS_HOOKS=[
+        'jobparse.tests.instrument.failing_hook',
+        'jobparse.tests.instrument.record_hook'])
+    def test_emit(self):
+        """
+        Test that the time in each stage and the counts are added up, that
+        queries are counted without being recorded, and that the record
+        reaches every hook even if one fails.
+
+        """
+        stats = instrument.ImportStats(1, run='test')
+
+        for i in range(2):
+            with stats.timer('parse'):
+                stats.count('jobs')
+
+        queries = len(connection.queries)
+
+        with stats.count_queries():
+            list(BusinessUnit.objects.all())
+            list(BusinessUnit.objects.all())
+
+        self.assertEqual(len(connection.queries), queries)
+
+        record = stats.emit()
+        self.assertEqual(records, [record])
+        self.assertEqual(record['buid'], 1)
+        self.assertEqual(record['run'], 'test')
+        self.assertEqual(record['counts'], {'jobs': 2, 'db_queries': 2})
+        self.assertEqual(record['stages'].keys(), ['parse'])
+        self.assertTrue(record['seconds'] >= record['stages']['parse'])
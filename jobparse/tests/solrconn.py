@@ -0,0 +1,213 @@
+import threading
+import time
+
+from django.test import TestCase
+
+from jobparse.solrconn import (MemorySolr, SolrBatcher, SolrConnections,
+                                SolrWriter, delete_ids)
+
+
+class RecordingSolr(object):
+    """Stands in for a Solr client, recording the requests it gets."""
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def add(self, docs, **kwargs):
+        self._request('add', docs[0]['id'])
+
+    def delete(self, q=None, **kwargs):
+        self._request('delete', q)
+
+    def _update(self, message, **kwargs):
+        self._request('update', message)
+
+    def _request(self, method, key):
+        with self.lock:
+            self.requests.append(('start', method, key))
+        time.sleep(0.01)
+
+        if key == self.fail_on:
+            raise ValueError(key)
+
+        with self.lock:
+            self.requests.append(('end', method, key))
+
+
+class SolrConnectionsTestCase(TestCase):
+    def setUp(self):
+        super(SolrConnectionsTestCase, self).setUp()
+        self.url = "http://127.0.0.1:8983/solr/"
+        self.connections = SolrConnections(pool_size=2, timeout=5)
+
+    def tearDown(self):
+        self.connections.clear()
+        super(SolrConnectionsTestCase, self).tearDown()
+
+    def test_client_reused(self):
+        """
+        Test that every request for the same URL goes through the same
+        client and the same keep-alive connection.
+
+        """
+        conn = self.connections.get(self.url)
+        self.assertEqual(conn.timeout, 5)
+
+        for i in range(5):
+            self.connections.get(self.url).search(q="*:*", rows=0)
+
+        self.assertTrue(self.connections.get(self.url) is conn)
+        self.assertEqual(self.connections.stats(),
+                         {'clients': 1, 'connections': 1, 'requests': 5})
+
+
+class SolrWriterTestCase(TestCase):
+    def test_deletes_wait_for_adds(self):
+        """
+        Test that every request is sent, and that no delete starts before
+        all the adds queued ahead of it have finished.
+
+        """
+        conn = RecordingSolr()
+        writer = SolrWriter(conn, threads=4, max_pending=2)
+
+        for i in range(10):
+            writer.add([{'id': i}])
+
+        writer.delete(size=1, q="uid:1")
+        writer.close()
+        requests = conn.requests
+        first_delete = requests.index(('start', 'delete', "uid:1"))
+        self.assertEqual(len([r for r in requests[:first_delete]
+                              if r[0] == 'end']), 10)
+        self.assertEqual(requests[-1], ('end', 'delete', "uid:1"))
+        self.assertEqual(writer.stats()['add']['requests'], 10)
+
+    def test_delete_ids(self):
+        """
+        Test that a batch of ids is deleted with a single request.
+
+        """
+        conn = RecordingSolr()
+        delete_ids(conn, ['seo.joblisting.1', 'seo.joblisting.2'])
+        self.assertEqual(conn.requests[-1],
+                         ('end', 'update',
+                          '<delete><id>seo.joblisting.1</id>'
+                          '<id>seo.joblisting.2</id></delete>'))
+
+    def test_error_raised(self):
+        """
+        Test that a failed request stops the writer and that its exception
+        is raised to the caller.
+
+        """
+        writer = SolrWriter(RecordingSolr(fail_on=0), threads=1)
+        writer.add([{'id': 0}])
+        self.assertRaises(ValueError, writer.close)
+        self.assertRaises(ValueError, writer.add, [{'id': 1}])
+
+
+class SolrBatcherTestCase(TestCase):
+    def test_batches_by_size(self):
+        """
+        Test that batches of long documents hold fewer documents than
+        batches of short ones, and that no document is lost.
+
+        """
+        batcher = SolrBatcher(target_bytes=2000)
+        batches = []
+
+        for i in range(100):
+            doc = {'uid': i, 'description': 'x' * (1000 if i < 50 else 100)}
+            batch = batcher.add(doc)
+
+            if batch:
+                batches.append(batch)
+
+        batches.append(batcher.flush())
+        self.assertTrue(len(batches[0]) < len(batches[-2]))
+        self.assertEqual([doc['uid'] for batch in batches for doc in batch],
+                         range(100))
+
+    def test_target_adapts(self):
+        """
+        Test that slow requests shrink the batches, fast ones grow them,
+        and neither goes past the bounds.
+
+        """
+        batcher = SolrBatcher(target_bytes=1600, target_seconds=1.0)
+        batcher.record(2.0)
+        self.assertEqual(batcher.target_bytes, 800)
+        batcher.record(0.1)
+        self.assertEqual(batcher.target_bytes, 1000)
+
+        for i in range(10):
+            batcher.record(2.0)
+
+        self.assertEqual(batcher.target_bytes, batcher.min_bytes)
+
+        for i in range(50):
+            batcher.record(0.1)
+
+        self.assertEqual(batcher.target_bytes, batcher.max_bytes)
+
+
+class MemorySolrTestCase(TestCase):
+    def setUp(self):
+        super(MemorySolrTestCase, self).setUp()
+        self.solr = MemorySolr()
+        self.solr.add([{'id': 'seo.joblisting.%s' % uid, 'uid': str(uid),
+                        'buid': uid % 2, 'title': 'Job %s' % uid}
+                       for uid in range(10)])
+
+    def _uids(self, q='*:*', **kwargs):
+        return [doc['uid'] for doc in self.solr.search(q, **kwargs).docs]
+
+    def test_search(self):
+        """
+        Test that queries, filters, sorting, paging and field lists are
+        answered the way Solr answers them.
+
+        """
+        self.assertEqual(self.solr.search('*:*').hits, 10)
+        self.assertEqual(self._uids(fq='buid:1', sort='uid asc'),
+                         [1, 3, 5, 7, 9])
+        self.assertEqual(self._uids('uid:{3 TO *}', fq='buid:1',
+                                    sort='uid asc'), [5, 7, 9])
+        self.assertEqual(self._uids('uid:[3 TO 5]', sort='uid desc'),
+                         [5, 4, 3])
+        self.assertEqual(sorted(self._uids('uid:(2 OR 4 OR 5) -buid:1')),
+                         [2, 4])
+        self.assertEqual(self._uids(sort='uid asc', start=8, rows=5),
+                         [8, 9])
+        self.assertEqual(self.solr.search('uid:3', fl='uid,score').docs,
+                         [{'uid': 3}])
+
+    def test_delete(self):
+        """
+        Test that documents are deleted by query, by id, and by the
+        messages `delete_ids` sends.
+
+        """
+        self.solr.delete(q='buid:1')
+        self.assertEqual(self.solr.search('*:*').hits, 5)
+        self.solr.delete(id='seo.joblisting.0')
+        delete_ids(self.solr, ['seo.joblisting.2', 'seo.joblisting.4'])
+        self.assertEqual(self._uids(sort='uid asc'), [6, 8])
+
+    def test_calls(self):
+        """
+        Test that every call is recorded with its size and the time it
+        took, including the latency asked for.
+
+        """
+        self.solr.latency = 0.01
+        self.solr.search('uid:3')
+        delete_ids(self.solr, ['seo.joblisting.3'])
+        self.assertEqual(self.solr.count(), 3)
+        self.assertEqual([call[0] for call in self.solr.calls],
+                         ['add', 'search', 'delete'])
+        self.assertEqual(self.solr.count('search'), 1)
+        self.assertTrue(self.solr.size('add') > 10 * len('Job 1'))
+        self.assertTrue(all(call[2] >= 0.01 for call in self.solr.calls[1:]))
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
+import copy
 import os.path
 import shutil
 import datetime
+import time
+
+from lxml import etree
 
 from django.conf import settings
 from django.test import TestCase
@@ -10,9 +14,22 @@ from pysolr import Solr
 
 from jobparse import import_jobs, xmlparse
 from ..models import BusinessUnit, jobListing
+from . import feedgen
 from .factories import BusinessUnitFactory
 
 
+class CountingReader(object):
+    """A file-like object that counts the bytes read from it."""
+    def __init__(self, f):
+        self.f = f
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
 class JobFeedTestCase(TestCase):
 
     def setUp(self):
@@ -66,6 +83,159 @@ class JobFeedTestCase(TestCase):
         for job in jobs:
             self.assertTrue('mocid' in job)
 
+    def test_dev2_feed_from_stream(self):
+        """
+        Test that a feed read from a file-like object in stream mode gives
+        the same jobs as the same feed read from its path.
+
+        """
+        filepath = import_jobs.download_feed_file(self.buid_id)
+        jobs = xmlparse.DEv2JobFeed(filepath).jobparse()
+
+        with open(filepath) as f:
+            feed = xmlparse.DEv2JobFeed(f, stream=True)
+            self.assertEqual(feed.jsid, self.buid_id)
+            self.assertEqual(feed.jobparse(), jobs)
+            self.assertRaises(ValueError, feed.jobparse)
+
+    def test_stream_clears_jobs(self):
+        """
+        Test that in stream mode each job element is cleared once the next
+        one is asked for, and the elements before it are removed from the
+        tree, so that the tree never holds more than the job being worked
+        on and the empty element of the one before it.
+
+        """
+        filepath = import_jobs.download_feed_file(self.buid_id)
+        previous = None
+        count = 0
+
+        for element in xmlparse.DEv2JobFeed(filepath,
+                                            stream=True).job_nodes():
+            self.assertTrue(element.getprevious() in (None, previous))
+
+            if previous is not None:
+                self.assertEqual(len(previous), 0)
+                self.assertIsNone(previous.getprevious())
+
+            previous = element
+            count += 1
+
+        self.assertEqual(count, self.numjobs)
+
+    def test_read_header_single_pass(self):
+        """
+        Test that in stream mode the header is read without reading the
+        whole feed, and that reading the jobs carries on from where it
+        stopped, so that the feed file is read exactly once.
+
+        """
+        filepath = import_jobs.download_feed_file(self.buid_id)
+        # Make the feed larger than the parser reads at once, so that the
+        # header can be read without reading all of it.
+        doc = etree.parse(filepath)
+        jobs = doc.find('jobs')
+
+        for i in range(1000):
+            jobs.append(copy.deepcopy(jobs[0]))
+
+        doc.write(filepath)
+        size = os.path.getsize(filepath)
+
+        with open(filepath, 'rb') as f:
+            reader = CountingReader(f)
+            feed = xmlparse.DEv2JobFeed(reader, stream=True)
+            self.assertEqual(feed.jsid, self.buid_id)
+            self.assertTrue(feed.crawled_date)
+            self.assertTrue(reader.bytes_read < size)
+            self.assertEqual(len(feed.jobparse()), self.numjobs + 1000)
+
+        self.assertEqual(reader.bytes_read, size)
+
+    def test_iter_solr_uids(self):
+        """
+        Test that paging through the UIDs in the Solr index for a business
+        unit yields each of them once, in order.
+
+        """
+        filepath = import_jobs.download_feed_file(self.buid_id)
+        jobs = xmlparse.DEv2JobFeed(filepath).solr_jobs()
+        self.conn.add(jobs)
+        # A page size smaller than the number of jobs, so that more than
+        # one page is needed.
+        uids = list(import_jobs.iter_solr_uids(self.conn, self.buid_id,
+                                               rows=3))
+        # 'uid' is a long field in the index, so it comes back as a number
+        # and sorts numerically.
+        self.assertEqual(uids, sorted(long(job['uid']) for job in jobs))
+
+    def test_moc_index(self):
+        """
+        Test that once the MOC index has been loaded, building the Solr
+        documents for a feed doesn't query the database for each job, and
+        that the documents don't share lists with the index.
+
+        """
+        filepath = import_jobs.download_feed_file(self.buid_id)
+        results = xmlparse.DEv2JobFeed(filepath)
+        xmlparse.moc_index.load()
+
+        with self.assertNumQueries(0):
+            jobs = results.solr_jobs()
+
+        self.assertEqual(len(jobs), self.numjobs)
+
+        # Changing a document doesn't change the index.
+        for job in jobs:
+            if job['moc'] is not None:
+                job['moc'].append('changed')
+
+        self.assertFalse(any('changed' in (job['moc'] or [])
+                             for job in results.solr_jobs()))
+
+    def test_solr_fingerprint(self):
+        """
+        Test that the hash stored with a Solr document changes when the
+        MOCs mapped to the job's ONET code do, even though the job itself
+        hasn't changed.
+
+        """
+        filepath = import_jobs.download_feed_file(self.buid_id)
+        results = xmlparse.DEv2JobFeed(filepath)
+        job = results.jobparse()[0]
+        job['onet_id'] = u'11101100'
+        xmlparse.moc_index.load()
+        fingerprint = results.fingerprint(job)
+        content_hash = results.solr_fingerprint(job)
+        self.assertEqual(results.solr_job_dict(job)['content_hash'],
+                         content_hash)
+
+        xmlparse.moc_index._index[job['onet_id']] = xmlparse.MocData(
+            ('1234',), ('moc-slab',), (1,))
+
+        try:
+            self.assertEqual(results.fingerprint(job), fingerprint)
+            self.assertNotEqual(results.solr_fingerprint(job), content_hash)
+        finally:
+            xmlparse.moc_index.load()
+
+    def test_generated_feed(self):
+        """
+        Test that a feed written by `feedgen` is valid, and has the number
+        of jobs asked for, with values repeated across jobs.
+
+        """
+        filepath = os.path.join(settings.DATA_DIR, 'generated_feed.xml')
+        feedgen.write_feed(filepath, 200, buid=self.buid_id)
+        results = xmlparse.DEv2JobFeed(filepath, stream=True)
+        jobs = results.jobparse()
+        os.remove(filepath)
+        self.assertFalse(results.errors)
+        self.assertEqual(results.jsid, self.buid_id)
+        self.assertEqual(len(set(job['uid'] for job in jobs)), 200)
+        self.assertTrue(len(set(job['city'] for job in jobs)) < 30)
+        self.assertTrue(len(set(job['onet_id'] for job in jobs)) < 30)
+
     def test_empty_feed(self):
         """
         Test that the schema for the v2 DirectEmployers feed file schema
@@ -77,6 +247,17 @@ class JobFeedTestCase(TestCase):
         # trying to run jobparse() will throw an exception.
         self.assertEqual(len(results.jobparse()), 0)
 
+    def test_schema_compiled_once(self):
+        """
+        Test that every feed validates against the same compiled schema,
+        rather than reading and compiling the XSD file for each feed.
+
+        """
+        results = xmlparse.DEv2JobFeed(self.emptyfeed)
+        streamed = xmlparse.DEv2JobFeed(self.emptyfeed, stream=True)
+        self.assertIs(results.schema, xmlparse.get_feed_schema())
+        self.assertIs(streamed.schema, results.schema)
+
     def test_empty_solr(self):
         """
         Tests for the proper behavior when encountering a job-less, but
@@ -150,6 +331,22 @@ class JobFeedTestCase(TestCase):
         results2 = self.conn.search(q="*:*", sort="date_new asc")
         self.assertItemsEqual(results2.docs, results.docs)
 
+    def test_deterministic_salt_date(self):
+        """
+        Test that with deterministic salting, processing the same feed
+        twice gives identical Solr documents, and that the salted dates
+        stay on the same day as the date they were salted from.
+
+        """
+        filepath = import_jobs.download_feed_file(self.buid_id)
+        jobs = xmlparse.DEv2JobFeed(filepath, deterministic_salt=True)
+        solrjobs = jobs.solr_jobs()
+        self.assertEqual(solrjobs, jobs.solr_jobs())
+
+        for job in solrjobs:
+            self.assertEqual(job['salted_date'].date(),
+                             job['date_updated'].date())
+
     def test_date_updated(self):
         """
         Test to ensure proper behavior of date updated field when added to
@@ -167,6 +364,26 @@ class JobFeedTestCase(TestCase):
         for solr_date in solr_dates:
             self.assertEqual(solr_date, date_updated)
         
+    def test_get_strptime(self):
+        """
+        Test that the fast path for the DirectEmployers datetime format
+        gives the same results as `time.strptime`, and that strings it
+        doesn't handle are still parsed (or rejected) by strptime.
+
+        """
+        pattern = xmlparse.DE_DATETIME_PATTERN
+        timestamps = ["5/17/2012 12:01:05 PM", "5/17/2012 12:01:05 AM",
+                      "01/02/2013 1:02:03 pm", "2/29/2012 11:59:59 PM",
+                      "3/11/2012 2:30:00 AM", "1/1/2012 1:00:60 AM"]
+
+        for ts in timestamps:
+            expected = datetime.datetime.fromtimestamp(time.mktime(
+                time.strptime(ts, pattern)))
+            self.assertEqual(xmlparse.get_strptime(ts, pattern), expected)
+
+        self.assertRaises(ValueError, xmlparse.get_strptime,
+                          "2/30/2012 1:00:00 AM", pattern)
+
     def _get_feedfile(self):
         # Download the 'real' feed file then copy the empty feed file in its
         # place.
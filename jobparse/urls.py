@@ -9,8 +9,9 @@ LOG = logging.getLogger('jobparse.views')
 def send_sns_confirm(response):
     """
     Receive 'ping' from Amazon SNS that an XML feed is ready for parsing,
-    then dispatch tasks to parse that file for entry into both Solr and
-    the RDBMS.
+    then dispatch a task to parse that file for entry into both Solr and
+    the RDBMS. Notifications for a Business Unit that is already queued or
+    being refreshed are coalesced; see `tasks.notify_refresh`.
     
     """
     LOG.info("sns received", extra = {
@@ -22,5 +23,6 @@ def send_sns_confirm(response):
     if response:
         # 'buid' is an integer representing the ID of the business unit.
         buid = response['Subject']
-        tasks.task_refresh_bunit_jobs.delay(buid, update_all=True)
-        tasks.task_update_solr.delay(buid, force=True)
+
+        if not tasks.notify_refresh(buid):
+            LOG.info("refresh already pending for buid %s" % buid)
@@ -4,21 +4,35 @@ in import_jobs.py and into list of dictionaries for Solr
 
 """
 
+import calendar
 import datetime
+import hashlib
+import os
 import random
+import re
 import time
 from collections import namedtuple
+from itertools import chain
 from HTMLParser import HTMLParser
 from lxml import etree
 from moc_coding import models as moc_models
-from slugify import slugify
 from templated_emails import utils
 
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import Signal
 
+from jobparse.helpers import LRUCache, slug
 from jobparse.models import jobListing
 
 
+# The datetime format used by DirectEmployers feed files, and a regex that
+# matches the strings `time.strptime` accepts for it.
+DE_DATETIME_PATTERN = '%m/%d/%Y %I:%M:%S %p'
+DE_DATETIME_RE = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4}) (\d{1,2}):(\d{1,2}):'
+                            r'(\d{1,2}) ([AaPp][Mm])\Z')
+
+
 def send_error_notice(sender, **kwargs):
     """
     A receiver to handle ``directseo.xmlparse.feed_error`` signal. When
@@ -32,6 +46,111 @@ def send_error_notice(sender, **kwargs):
 feed_error = Signal(providing_args=['buid', 'exception', 'line'])
 feed_error.connect(send_error_notice)
 
+# Compiled XMLSchema instances, keyed by the absolute path of the XSD file
+# they were compiled from.
+_schemas = {}
+
+
+def get_feed_schema(path=None):
+    """
+    Return the compiled XMLSchema for the feed file schema. The XSD is
+    only read and compiled the first time it is asked for in a given
+    process; every later call returns the same instance.
+
+    Input:
+    :path: The path to the XSD file. Defaults to the FEED_SCHEMA_PATH
+    setting, or to 'feed_schema.xsd' in the current working directory if
+    that is not set.
+
+    """
+    path = os.path.abspath(path or getattr(settings, 'FEED_SCHEMA_PATH',
+                                           'feed_schema.xsd'))
+
+    if path not in _schemas:
+        _schemas[path] = etree.XMLSchema(etree.parse(path))
+
+    return _schemas[path]
+
+
+MocData = namedtuple("MocData", "codes slabs ids")
+
+
+class MocIndex(object):
+    """
+    An in-memory map of ONET codes to the MOC codes, slabs and ids that
+    `JobFeed.job_mocs` needs for each job.
+
+    Every MOC/ONET pairing is loaded with a single query the first time a
+    code is looked up, so building Solr documents doesn't need a query
+    per job. The index is thrown away when MOC data is changed in this
+    process, and is reloaded after `ttl` seconds regardless, so changes
+    made by other processes are picked up as well.
+
+    """
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._index = None
+        self._loaded = None
+
+    def get(self, onet):
+        """
+        Return a MocData instance for the ONET code `onet`. Its lists are
+        new copies, since they end up in Solr documents that may be
+        changed after they are built.
+
+        """
+        self.refresh()
+        mocdata = self._index.get(unicode(onet), MocData((), (), ()))
+        return MocData(list(mocdata.codes), list(mocdata.slabs),
+                       list(mocdata.ids))
+
+    def refresh(self):
+        """Load the index if it isn't loaded or is over `ttl` seconds old."""
+        if self._index is None or time.time() - self._loaded > self.ttl:
+            self.load()
+
+    def load(self):
+        index = {}
+        # One row per MOC/ONET pair, in the same order as the queryset
+        # job_mocs used to run for each job.
+        mocs = moc_models.Moc.objects.values_list('onets', 'id', 'code',
+                                                  'title', 'branch')
+        slabs = {}
+
+        for onet, moc_id, code, title, branch in mocs:
+            if onet is None:
+                continue
+
+            if moc_id not in slabs:
+                slabs[moc_id] = "%s/%s/%s/vet-jobs::%s - %s" % (
+                    slug(title), code, branch, code, title)
+
+            mocdata = index.setdefault(unicode(onet), MocData([], [], []))
+            mocdata.codes.append(code)
+            mocdata.slabs.append(slabs[moc_id])
+            mocdata.ids.append(moc_id)
+
+        # Tuples, so that nothing handed an entry can change the index.
+        self._index = dict((onet, MocData(*map(tuple, mocdata)))
+                           for onet, mocdata in index.iteritems())
+        self._loaded = time.time()
+
+    def invalidate(self, **kwargs):
+        """
+        Throw away the index so it is reloaded on the next lookup. Accepts
+        the keyword arguments sent with model signals.
+
+        """
+        self._index = None
+
+moc_index = MocIndex(ttl=getattr(settings, 'MOC_INDEX_TTL', 3600))
+post_save.connect(moc_index.invalidate, sender=moc_models.Moc,
+                  dispatch_uid='jobparse.moc_index.save')
+post_delete.connect(moc_index.invalidate, sender=moc_models.Moc,
+                    dispatch_uid='jobparse.moc_index.delete')
+m2m_changed.connect(moc_index.invalidate, sender=moc_models.Moc.onets.through,
+                    dispatch_uid='jobparse.moc_index.onets')
+
 
 class JobFeed(object):
     """
@@ -45,7 +164,9 @@ class JobFeed(object):
     query the database for a BusinessUnit instance.
     filepath -- A string describing the path to the feedfile to be parsed.
     This must be the feed file for the Business Unit referred to by the
-    `business_unit` arg.
+    `business_unit` arg. It may also be a file-like object to read the
+    feed from, such as a `download.PrefetchReader`; a stream can only be
+    read once, so in stream mode the jobs can then only be iterated once.
     co_field -- String. The name of the XML tag containing the name of
     the company the jobs belong to.
     crawl_field -- String. The name of the XML tag containing the datetime
@@ -55,40 +176,194 @@ class JobFeed(object):
     datetime_pattern -- A string specifying the format of the datetime
     data in the feed. Should conform to the specification outlined here:
     http://docs.python.org/library/time.html#time.strftime
+    stream -- Boolean. If True, the feed file is not loaded into memory
+    as a whole. Jobs are instead read incrementally by `iterjobs`, and
+    each job node is discarded as soon as it has been converted, so peak
+    memory use does not depend on the size of the feed.
     
     """
     def __init__(self, filepath, co_field=None, crawl_field=None, node_tag=None,
-                 datetime_pattern=None):
+                 datetime_pattern=None, stream=False):
         if None in (co_field, crawl_field, datetime_pattern):
             raise AttributeError("You must specify valid values for co_field, "
                                  "datetime_pattern and crawl_field.")
 
         self.filepath = filepath
-        self.doc = etree.parse(self.filepath)
+        self.stream = stream
+        self.schema = self.get_schema()
         self.datetime_pattern = datetime_pattern
         self.node_tag = node_tag
+
+        # Read every document-level tag in one pass, stopping where the job
+        # nodes begin. In stream mode the rest of the events are kept so
+        # that `job_nodes` picks up where the header left off and the feed
+        # file is only read once.
+        if stream:
+            self.doc = None
+
+            self._parser = self.iterparse()
+
+            try:
+                self.header, self._events = self.read_header(self._parser)
+            except etree.XMLSyntaxError as e:
+                self.header, self._events = {}, iter(())
+                self.stream_error(e)
+        else:
+            self.doc = etree.parse(self.filepath)
+            self.header = self.read_header(etree.iterwalk(self.doc))[0]
+
         self.company = self.parse_doc(co_field)
         self.crawled_date = get_strptime(self.parse_doc(crawl_field),
                                          self.datetime_pattern)
         
-    def jobparse(self):
+    def job_dict(self, job):
         """
         This method must return a dictionary, where the keys are fields
         on the jobListing model, including foreign key fields. The only
         exceptions to this are any calculated fields. The only such
         fields right now are the 'location' field and any slugfields.
 
+        Input:
+        :job: The lxml element for a single job node.
+
         """
         raise NotImplementedError
+
+    def jobparse(self):
+        """Return a list of dictionaries from job_dict."""
+        return list(self.iterjobs())
+
+    def iterjobs(self):
+        """
+        Yield a dictionary from job_dict for each job in the feed, one at
+        a time.
+
+        """
+        for job in self.job_nodes():
+            yield self.job_dict(job)
+
+    def job_nodes(self):
+        """
+        Yield the element for each job node in the feed.
+
+        In stream mode the feed file is read with `etree.iterparse`. Once
+        the consumer asks for the next node, the previous one is cleared
+        and removed from the tree along with any siblings that preceded
+        it, so only the job currently being worked on is held in memory.
+
+        If there is a schema, the parser validates the feed as it reads
+        it. Validation errors are recorded before the events for the part
+        of the file they were found in are handed out, so each job is
+        checked against the parser's error log before it is yielded, and
+        iteration stops at the first error without letting an invalid job
+        through.
+
+        """
+        if not self.stream:
+            for job in self.doc.find(self.node_tag).iterchildren():
+                yield job
+            return
+
+        events, self._events = self._events, None
+
+        try:
+            # The events left over from the constructor have been used up by
+            # an earlier pass, so start reading the feed file over again.
+            if events is None:
+                if not isinstance(self.filepath, basestring):
+                    raise ValueError("A feed read from a stream can only be "
+                                     "iterated over once.")
+
+                self._parser = self.iterparse()
+                events = self.read_header(self._parser)[1]
+
+            for event, element in events:
+                parent = element.getparent()
+
+                if parent is None or parent.tag != self.node_tag:
+                    continue
+
+                if self.schema is not None:
+                    error = self._parser.error_log.last_error
+
+                    if error is not None:
+                        self.validation_error(error)
+                        return
+
+                yield element
+                element.clear()
+
+                while element.getprevious() is not None:
+                    del parent[0]
+        except etree.XMLSyntaxError as e:
+            self.stream_error(e)
+
+    def stream_error(self, exc):
+        """
+        Handle an error raised by the incremental parser in stream mode.
+        Since the feed is never loaded as a whole, this is also where
+        schema validation errors surface.
+
+        """
+        raise exc
+
+    def get_schema(self):
+        """
+        Return the XMLSchema feed files are validated against, or None.
+        In stream mode the schema is handed to the incremental parser, and
+        subclasses that return one must implement `validation_error`.
+
+        """
+        return None
+
+    def validation_error(self, error):
+        """
+        Handle a schema validation error.
+
+        Input:
+        :error: The lxml error log entry describing the error.
+
+        """
+        raise NotImplementedError
+
+    def iterparse(self):
+        """Return an incremental parser over the feed file."""
+        return etree.iterparse(self.filepath, events=('end',),
+                               schema=self.schema)
+
+    def read_header(self, events):
+        """
+        Collect the document-level tags from an iterator of (event,
+        element) pairs, stopping at the first element that belongs to the
+        node_tag element.
+
+        Returns:
+        A 2-tuple of a dictionary mapping each tag to the text of its first
+        occurrence, and an iterator over the remaining events, starting
+        with the one that ended the header.
+
+        """
+        header = {}
+
+        for event, element in events:
+            in_jobs = next(element.iterancestors(self.node_tag), None)
+
+            if element.tag == self.node_tag or in_jobs is not None:
+                return header, chain([(event, element)], events)
+
+            header.setdefault(element.tag, element.text)
+
+        return header, iter(())
         
     def joblist(self):
         return [jobListing(**i) for i in self.jobparse()]
 
-    def solr_job_dict(self, job_node):
+    def solr_job_dict(self, job_node, content_hash=None):
         """
         This method must return a dictionary consisting of a mapping
         between fields in the Solr schema (defined in seo.search_indexes)
-        and a single job.
+        and a single job. `content_hash` is the job's `solr_fingerprint`,
+        if the caller has already worked it out.
 
         """
         raise NotImplementedError
@@ -100,22 +375,47 @@ class JobFeed(object):
         """
         return [self.solr_job_dict(node) for node in self.jobparse()]
 
+    def iter_solr_jobs(self):
+        """Yield the dictionaries from solr_job_dict one at a time."""
+        for node in self.iterjobs():
+            yield self.solr_job_dict(node)
+
+    def fingerprint(self, job):
+        """
+        Return a hash of the contents of a job record (see `job_dict`)
+        and of the company name. If the fingerprint of a job hasn't
+        changed since it was last written, neither has anything the
+        database or Solr would hold for it, other than data that doesn't
+        come from the feed, like MOCs.
+
+        """
+        content = u"\x1e".join(u"%s\x1f%s" % (key, job[key])
+                               for key in sorted(job))
+        content = u"%s\x1e%s" % (self.company, content)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def solr_fingerprint(self, job, fingerprint=None):
+        """
+        Return a hash of `fingerprint` (the job's `fingerprint`, worked out
+        here if not given) and of the MOC data for the job. Solr documents
+        also carry the MOCs mapped to the job's ONET code, so this changes
+        when that mapping does, even if the feed doesn't.
+
+        """
+        fingerprint = fingerprint or self.fingerprint(job)
+        mocdata = self.job_mocs(job)
+        content = u"\x1e".join([fingerprint] +
+                                [u"\x1f".join(map(unicode, values or ()))
+                                 for values in mocdata])
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
     def job_mocs(self, job):
         """
         Return a list of MOCs and MOC slabs for a given job.
         
         """
-        MocData = namedtuple("MocData", "codes slabs ids")
-        
         if job['onet_id']:
-            mocs = moc_models.Moc.objects.filter(onets=job['onet_id'])
-            moc_set = [moc.code for moc in mocs]
-            moc_slab = ["%s/%s/%s/vet-jobs::%s - %s" %
-                        (slugify(moc.title), moc.code, moc.branch, moc.code,
-                         moc.title)
-                        for moc in mocs]
-            moc_ids = [moc.id for moc in mocs]
-            return MocData(moc_set, moc_slab, moc_ids)
+            return moc_index.get(job['onet_id'])
         else:
             return MocData(None, None, None)
 
@@ -126,12 +426,23 @@ class JobFeed(object):
 
     def parse_doc(self, field, wrapper=None):
         """Use for retrieving document-level (as opposed to job-level) tags."""
-        for event, element in etree.iterwalk(self.doc):
-            if element.tag == field:
-                if wrapper:
-                    return wrapper(element.text)
-                else:
-                    return element.text
+        if field in self.header:
+            text = self.header[field]
+        elif self.stream:
+            return
+        else:
+            # Not part of the header, so search the whole document.
+            for event, element in etree.iterwalk(self.doc):
+                if element.tag == field:
+                    text = element.text
+                    break
+            else:
+                return
+
+        if wrapper:
+            return wrapper(text)
+        else:
+            return text
         
     def unescape(self, val):
         h = HTMLParser()
@@ -148,52 +459,89 @@ class JobFeed(object):
     def country_slab(self, obj):
         return "%s/jobs::%s" % (obj['country_short'].lower(), obj['country'])
 
-    def state_slab(self, obj):
-        if slugify(obj['state']):
-            url = "%s/%s/jobs" % (slugify(obj['state']),
-                                  obj['country_short'].lower())
+    def state_slab(self, obj, state_slug=None):
+        if state_slug is None:
+            state_slug = slug(obj['state'])
+
+        if state_slug:
+            url = "%s/%s/jobs" % (state_slug, obj['country_short'].lower())
             
             return "%s::%s" % (url, obj['state'])
 
-    def city_slab(self, obj):
-        url = "%s/%s/%s/jobs" % (slugify(obj['city']), slugify(obj['state']), 
+    def city_slab(self, obj, city_slug=None, state_slug=None):
+        if city_slug is None:
+            city_slug = slug(obj['city'])
+
+        if state_slug is None:
+            state_slug = slug(obj['state'])
+
+        url = "%s/%s/%s/jobs" % (city_slug, state_slug,
                                  obj['country_short'].lower())
         return "%s::%s" % (url, obj['location'])
 
-    def title_slab(self, obj):
-        if slugify(obj['title']) and slugify(obj['title']) != "none":
-            return "%s/jobs-in::%s" % (slugify(obj['title']).strip('-'),
-                                       obj['title'])
+    def title_slab(self, obj, title_slug=None):
+        if title_slug is None:
+            title_slug = slug(obj['title'])
+
+        if title_slug and title_slug != "none":
+            return "%s/jobs-in::%s" % (title_slug.strip('-'), obj['title'])
 
     def co_slab(self):
-        return  u"{cs}/careers::{cn}".format(cs=slugify(self.company),
-                                             cn=self.company)
+        # The company is the same for every job in the feed.
+        if not hasattr(self, '_co_slab'):
+            self._co_slab = u"{cs}/careers::{cn}".format(
+                cs=slug(self.company), cn=self.company)
+
+        return self._co_slab
 
 
 class DEJobFeed(JobFeed):
+    """
+    A base for translators of DirectEmployers Foundation feed files.
+
+    args:
+    deterministic_salt -- Boolean. If True, the salt `date_salt` adds to
+    each job's date is derived from the job's uid and date rather than
+    picked at random, so an unchanged job gets the same salted_date (and
+    the same Solr document) every time it is processed. If it is None or
+    not given, the DETERMINISTIC_SALTED_DATE setting is used.
+
+    """
     def __init__(self, *args, **kwargs):
+        self.deterministic_salt = kwargs.pop('deterministic_salt', None)
+
+        if self.deterministic_salt is None:
+            self.deterministic_salt = getattr(
+                settings, 'DETERMINISTIC_SALTED_DATE', False)
+
         kwargs.update({
             'crawl_field': 'date_modified',
             'node_tag': 'jobs',
-            'datetime_pattern': '%m/%d/%Y %I:%M:%S %p'
+            'datetime_pattern': DE_DATETIME_PATTERN
         })
         super(DEJobFeed, self).__init__(*args, **kwargs)
 
-    def date_salt(self, date):
+    def date_salt(self, date, uid=None):
         """
-        Generate a new datetime value salted with a random value, so that
+        Generate a new datetime value salted with an offset, so that
         jobs will not be clumped together by job_source_id on the job list
-        pages. This time is constrained to between `date` and the
-        previous midnight so that jobs that are new on a given day don't
-        wind up showing up on the totally wrong day inadvertently.
+        pages. This time is constrained to the same day as `date` so that
+        jobs that are new on a given day don't wind up showing up on the
+        totally wrong day inadvertently.
+
+        The offset is random, unless `deterministic_salt` is True and a
+        `uid` is given. It is then derived from a hash of `uid` and `date`,
+        so the same job always gets the same salted time.
 
         Input:
         :date: A `datetime.datetime` object. Represents the date a job
         was posted.
+        :uid: The uid of the job. Used to derive the salt when
+        `deterministic_salt` is True.
 
         Returns:
-        A datetime object representing a random time between `date` and
-        the previous midnight.
+        A datetime object representing a time on the same day as `date`;
+        random, or fixed by `uid` and `date` as described above.
         
         """
         oneday = datetime.timedelta(hours=23, minutes=59, seconds=59)
@@ -206,7 +554,11 @@ class DEJobFeed(JobFeed):
         # seconds until midnight tonight
         end = (tonight - date).seconds
         # Number of seconds between 'date' and the previous midnight.
-        salt = random.randrange(-start, end)
+        if self.deterministic_salt and uid is not None:
+            digest = hashlib.md5("%s:%s" % (uid, date.isoformat())).hexdigest()
+            salt = int(digest[:12], 16) % (start + end) - start
+        else:
+            salt = random.randrange(-start, end)
         # seconds elapsed from epoch to 'date'
         seconds = time.mktime(date.timetuple())
         # Convert milliseconds -> time tuple
@@ -216,8 +568,12 @@ class DEJobFeed(JobFeed):
         # elements (year,month,day,hour,min,sec).
         return datetime.datetime(*salted_time[0:6])
         
-    def solr_job_dict(self, job_node):
-        job_dict = {}
+    def solr_job_dict(self, job_node, content_hash=None):
+        job_dict = {'content_hash':
+                    content_hash or self.solr_fingerprint(job_node)}
+        # The same job record may be shared with other consumers, so work on
+        # a copy rather than adding 'location' to it.
+        job_node = dict(job_node)
     
         if job_node['city'] and job_node['state_short']:
             job_node['location'] = job_node['city'] + ', ' + job_node['state_short']
@@ -230,11 +586,17 @@ class DEJobFeed(JobFeed):
         else:
             job_node['location'] = 'Global'
 
+        # Slug each field once and share the result with the slabs.
+        city_slug = slug(job_node['city'])
+        country_slug = slug(job_node['country'])
+        state_slug = slug(job_node['state'])
+        title_slug = slug(job_node['title'])
+
         country_slab = self.country_slab(job_node)
         company_slab = self.co_slab()
-        city_slab = self.city_slab(job_node)
-        state_slab = self.state_slab(job_node)
-        title_slab = self.title_slab(job_node)
+        city_slab = self.city_slab(job_node, city_slug, state_slug)
+        state_slab = self.state_slab(job_node, state_slug)
+        title_slab = self.title_slab(job_node, title_slug)
         mocdata = self.job_mocs(job_node)
         
         job_dict['buid'] = job_node['buid_id']
@@ -243,7 +605,7 @@ class DEJobFeed(JobFeed):
         job_dict['city_exact'] = job_node['city']
         job_dict['city_slab'] = city_slab
         job_dict['city_slab_exact'] = city_slab
-        job_dict['city_slug'] = slugify(job_node['city'])
+        job_dict['city_slug'] = city_slug
         job_dict['company'] = self.company
         job_dict['company_ac'] = self.company
         job_dict['company_exact'] = self.company
@@ -255,7 +617,7 @@ class DEJobFeed(JobFeed):
         job_dict['country_short'] = job_node['country_short']
         job_dict['country_slab'] = country_slab
         job_dict['country_slab_exact'] = country_slab
-        job_dict['country_slug'] = slugify(job_node['country'])
+        job_dict['country_slug'] = country_slug
         job_dict['date_new'] = job_node['date_new']
         job_dict['date_new_exact'] = job_node['date_new']
         job_dict['date_updated'] = job_node['date_updated']
@@ -272,20 +634,21 @@ class DEJobFeed(JobFeed):
         job_dict['onet'] = self.clean_onet(job_node['onet_id'])
         job_dict['onet_exact'] = self.clean_onet(job_node['onet_id'])
         job_dict['reqid'] = job_node['reqid']
-        job_dict['salted_date'] = self.date_salt(job_node['date_updated'])
+        job_dict['salted_date'] = self.date_salt(job_node['date_updated'],
+                                                 job_node['uid'])
         job_dict['state'] = job_node['state']
         job_dict['state_ac'] = job_node['state']
         job_dict['state_exact'] = job_node['state']
         job_dict['state_short'] = job_node['state_short']
         job_dict['state_slab'] = state_slab
         job_dict['state_slab_exact'] = state_slab
-        job_dict['state_slug'] = slugify(job_node['state'])
+        job_dict['state_slug'] = state_slug
         job_dict['title'] = job_node['title']
         job_dict['title_ac'] = job_node['title']
         job_dict['title_exact'] = job_node['title']
         job_dict['title_slab'] = title_slab
         job_dict['title_slab_exact'] = title_slab
-        job_dict['title_slug'] = slugify(job_node['title'])
+        job_dict['title_slug'] = title_slug
         job_dict['uid'] = job_node['uid']
         job_dict['zipcode'] = job_node['zipcode']
 
@@ -312,43 +675,38 @@ class DEv1JobFeed(DEJobFeed):
         kwargs.update({'co_field': 'business_unit_name'})
         super(DEv1JobFeed, self).__init__(*args, **kwargs)
     
-    def jobparse(self):
-        jobs = self.doc.find("jobs").iterchildren()
-        joblist=[]
-        for job in jobs:
-            jobdict = {}
+    def job_dict(self, job):
+        jobdict = {}
             
-            for attribute in job:
-                if attribute.tag == 'u_id':
-                    jobdict['uid'] = attribute.text
-                elif attribute.tag == 'onets':
-                    onet = attribute.find('onet')
-
-                    if onet is not None:
-                        jobdict['onet_id'] = onet.findtext('onet_code')
-                    else:
-                        jobdict['onet_id'] = None
-                        
-                elif attribute.tag == 'buid':
-                    jobdict['buid_id'] = attribute.text
-                elif attribute.tag == 'location':
-                    jobdict['country_short'] = attribute.findtext('country_short') or None
-                    jobdict['country'] = attribute.findtext('country') or None
-                    jobdict['state_short'] = attribute.findtext('state_short') or None
-                    jobdict['state'] = attribute.findtext('state') or None
-                    jobdict['city'] = attribute.findtext('city') or None
-                elif attribute.tag in ('description', 'city', 'state', 'title',
-                                       'country'):
-                    jobdict[attribute.tag] = self.unescape(attribute.text)
-                elif attribute.tag.startswith("date_"):
-                    jobdict[attribute.tag] = get_strptime(attribute.text,
-                                                          self.datetime_pattern)
+        for attribute in job:
+            if attribute.tag == 'u_id':
+                jobdict['uid'] = attribute.text
+            elif attribute.tag == 'onets':
+                onet = attribute.find('onet')
+
+                if onet is not None:
+                    jobdict['onet_id'] = onet.findtext('onet_code')
                 else:
-                    jobdict[attribute.tag] = attribute.text
+                    jobdict['onet_id'] = None
+                        
+            elif attribute.tag == 'buid':
+                jobdict['buid_id'] = attribute.text
+            elif attribute.tag == 'location':
+                jobdict['country_short'] = attribute.findtext('country_short') or None
+                jobdict['country'] = attribute.findtext('country') or None
+                jobdict['state_short'] = attribute.findtext('state_short') or None
+                jobdict['state'] = attribute.findtext('state') or None
+                jobdict['city'] = attribute.findtext('city') or None
+            elif attribute.tag in ('description', 'city', 'state', 'title',
+                                   'country'):
+                jobdict[attribute.tag] = self.unescape(attribute.text)
+            elif attribute.tag.startswith("date_"):
+                jobdict[attribute.tag] = get_strptime(attribute.text,
+                                                      self.datetime_pattern)
+            else:
+                jobdict[attribute.tag] = attribute.text
                     
-            joblist.append(jobdict)
-
-        return joblist
+        return jobdict
 
 
 class DEv2JobFeed(DEJobFeed):
@@ -359,28 +717,69 @@ class DEv2JobFeed(DEJobFeed):
     """
     def __init__(self, *args, **kwargs):
         kwargs.update({'co_field': 'job_source_name'})
+        # In stream mode validation errors can already surface while the
+        # header is being read.
+        self.jsid = 0
+        self.errors = False
+        self.error_messages = None
         super(DEv2JobFeed, self).__init__(*args, **kwargs)
         jsid = self.parse_doc("job_source_id")
 
         if jsid:
             self.jsid = int(jsid)
-        else:
-            self.jsid = 0
 
-        self.errors = False
-        self.error_messages = None
-        self.schema = etree.XMLSchema(etree.parse("feed_schema.xsd"))
+        self.fieldmap = self._fieldmap()
 
-        if not self.schema.validate(self.doc):
-            exc = self.schema.error_log.last_error
-            self.error_messages = {'exception': exc.message, 'line': exc.line,
-                                   'buid': self.jsid}
-            feed_error.send(sender=self, **self.error_messages)
-            self.errors = True
+        # There is no tree to validate in stream mode. The schema is checked
+        # by the parser as the jobs are read instead, so consumers must look
+        # at `errors` again once they have exhausted `iterjobs`.
+        if not self.stream and not self.schema.validate(self.doc):
+            self.validation_error(self.schema.error_log.last_error)
 
-    def jobparse(self):
+    def validation_error(self, error):
+        self.error_messages = {'exception': error.message, 'line': error.line,
+                               'buid': self.jsid}
+        feed_error.send(sender=self, **self.error_messages)
+        self.errors = True
+
+    def stream_error(self, exc):
+        self.validation_error(exc.error_log.last_error)
+
+    def get_schema(self):
+        return get_feed_schema()
+
+    def job_dict(self, job):
+        jobdict = {}
+
+        for key, value in self.fieldmap.items():
+
+            # Since buid_id is a static value we get from the top leve of
+            # the XML document, we just want to set the value directly,
+            # then ``continue`` through the fieldmap for-loop.
+            if key == 'buid_id':
+                jobdict[key] = value
+                continue
+            elif key == 'zipcode':
+                attr = job.find('zip')
+            else:
+                attr = job.find(value)
+
+            if key in ('date_new', 'date_updated'):
+                jobdict[key] = get_strptime(attr.text, self.datetime_pattern)
+            elif key == "onet_id":
+                jobdict[key] = self.clean_onet(attr.text)
+            else:
+                jobdict[key] = attr.text
+
+        return jobdict
+
+    def _fieldmap(self):
+        """
+        A mapping of jobListing attribute names to the names of the tags
+        in the feed that hold their values.
+
+        """
         fieldmap = {}
-        joblist=[]
         # Collection of all jobListing attribute names that are the same as in
         # the feed.
         fields = ('city', 'country', 'country_short', 'state', 'state_short',
@@ -394,33 +793,7 @@ class DEv2JobFeed(DEJobFeed):
         fieldmap['buid_id'] = self.jsid
         fieldmap['date_new'] = 'date_created'
         fieldmap['date_updated'] = 'date_modified'
-        
-        jobs = self.doc.find(self.node_tag).iterchildren()
-
-        for job in jobs:
-            jobdict = {}
-            for key, value in fieldmap.items():
-
-                # Since buid_id is a static value we get from the top leve of
-                # the XML document, we just want to set the value directly,
-                # then ``continue`` through the fieldmap for-loop.
-                if key == 'buid_id':
-                    jobdict[key] = value
-                    continue
-                elif key == 'zipcode':
-                    attr = job.find('zip')
-                else:
-                    attr = job.find(value)
-
-                if key in ('date_new', 'date_updated'):
-                    jobdict[key] = get_strptime(attr.text, self.datetime_pattern)
-                elif key == "onet_id":
-                    jobdict[key] = self.clean_onet(attr.text)
-                else:
-                    jobdict[key] = attr.text
-            
-            joblist.append(jobdict)
-        return joblist
+        return fieldmap
 
     
 def get_strptime(ts, pattern):
@@ -428,6 +801,55 @@ def get_strptime(ts, pattern):
     if not ts:
         return None
     else:
-        return datetime.datetime.fromtimestamp(time.mktime(
-            time.strptime(ts, pattern)))
+        return _datetimes((ts, pattern))
+
+
+def _parse_datetime(args):
+    ts, pattern = args
+    timetuple = None
+
+    if pattern == DE_DATETIME_PATTERN:
+        timetuple = _parse_de_datetime(ts)
+
+    if timetuple is None:
+        timetuple = time.strptime(ts, pattern)
+
+    # Round-trip through the local time so that the result is the same as
+    # it has always been, e.g. for times skipped by a DST change.
+    return datetime.datetime.fromtimestamp(time.mktime(timetuple))
+
+
+def _parse_de_datetime(ts):
+    """
+    Parse a string in DE_DATETIME_PATTERN without going through
+    `time.strptime`. Returns a time tuple in the same form as strptime
+    would, or None if the string is not one this parser is sure about,
+    in which case strptime should be used instead.
+
+    """
+    match = DE_DATETIME_RE.match(ts)
+
+    if not match:
+        return None
+
+    month, day, year, hour, minute, second = [int(i) for i in
+                                              match.group(1, 2, 3, 4, 5, 6)]
+
+    if not (1 <= month <= 12 and 1 <= hour <= 12 and minute <= 59 and
+            second <= 59 and 1 <= day <= calendar.monthrange(year, month)[1]):
+        return None
+
+    # 12 AM is midnight and 12 PM is noon.
+    hour %= 12
+
+    if match.group(7).upper() == 'PM':
+        hour += 12
+
+    # tm_isdst is -1, as it is from strptime, so mktime works out whether
+    # DST is in effect. mktime ignores tm_wday and tm_yday.
+    return (year, month, day, hour, minute, second, 0, 0, -1)
+
+
+# Many jobs in a feed share identical timestamps.
+_datetimes = LRUCache(_parse_datetime, maxsize=10000)
 
@@ -1,5 +1,4 @@
-from distutils.core import setup
-from setuptools import find_packages
+from setuptools import find_packages, setup
 setup(
     name = "dseo-jobparse",
     version = "1.0",
@@ -7,16 +6,32 @@ setup(
     author = "DirectEmployers Foundation",
     author_email = "jmclaughlin@directemployersfoundation.org",
     long_description = open('README.rst', 'r').read(),
+    install_requires = [
+        # solrconn.SolrConnections mounts its connection pool on the
+        # requests session of a pysolr.Solr client, which pysolr only has
+        # from 3.0 to 3.2, and reads the counters of urllib3's pools.
+        'pysolr>=3.0,<3.3',
+        'requests>=1.0,<3.0'
+    ],
     package_data = {
         'jobparse': [
+            'tests/coalesce.py',
+            'tests/download.py',
             'tests/factories.py',
+            'tests/feedgen.py',
+            'tests/feedstore.py',
+            'tests/helpers.py',
             'tests/xmlparse.py',
             'tests/import_jobs.py',
+            'tests/instrument.py',
+            'tests/solrconn.py',
             'tests/dseo_feed_0.no_jobs.xml'
         ]
     },
     packages = [
         'jobparse',
+        'jobparse.management',
+        'jobparse.management.commands',
         'jobparse.tests'
     ],
     classifiers = [